@@ -0,0 +1,271 @@
+"""
+End-to-end benchmark of the rank update cycle.
+
+Runs RankUpdate.update_ranks against a local stand-in for the osu! API, fake Discord guilds and a seeded database.
+Every registered user is checked in a single run. Each user count is run in its own process so peak RSS is measured
+separately. Run from the repository root with a config in place:
+
+    python benchmarks/cycle.py --users 1000 10000 100000
+
+Add --engine sqlite to run against an embedded SQLite file instead of Postgres.
+The database named by --dbname or --path is wiped and reseeded, so never point it at the bot's own database.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import resource
+import subprocess
+import sys
+from datetime import timedelta
+from pathlib import Path
+from time import perf_counter
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+from fake_discord import FakeBot, FakeGuild  # noqa E402
+from fake_osu import FakeOsuApi  # noqa E402
+
+from cogs.rank_update import RankUpdate  # noqa E402
+from cogs.utils import database  # noqa E402
+from cogs.utils.osu_api import Gamemode, OsuApi  # noqa E402
+
+ROLE_COLUMNS = (
+    'role_1_digit', 'role_2_digit', 'role_3_digit', 'role_4_digit', 'role_5_digit', 'role_6_digit', 'role_7_digit',
+    'role_standard', 'role_taiko', 'role_ctb', 'role_mania'
+)
+
+
+def build_guilds(users: int, guild_count: int, edit_latency: float) -> list[FakeGuild]:
+    """
+    Builds fake guilds with every rank role set up. Every user is a member of one guild,
+    and every tenth user is also in a second one, like players who are in more than one community
+
+    Parameters
+    ----------
+    users (int): Number of registered users
+    guild_count (int): Number of guilds
+    edit_latency (float): Seconds every member edit takes
+
+    Returns
+    ----------
+    list[FakeGuild]: The guilds
+    """
+
+    guilds = [FakeGuild(g + 1, [(g + 1) * 100 + r for r in range(len(ROLE_COLUMNS))], edit_latency)
+              for g in range(guild_count)]
+
+    for i in range(users):
+        discord_id = discord_id_of(i)
+        guilds[i % guild_count].add_member(discord_id)
+        if guild_count > 1 and i % 10 == 0:
+            guilds[(i + 1) % guild_count].add_member(discord_id)
+
+    return guilds
+
+
+def discord_id_of(i: int) -> int:
+    return 100000000000000000 + i
+
+
+async def seed(users: int, guilds: list[FakeGuild]) -> None:
+    """
+    Wipes the benchmark database and registers every user
+
+    Parameters
+    ----------
+    users (int): Number of registered users
+    guilds (list[FakeGuild]): The guilds to create rows for
+    """
+
+    engine = await database.Database.get_engine()
+    async with engine.connection() as connection:
+        for table in ('update_job', 'user_rank_state', 'verification', 'user', 'guild'):
+            await connection.execute(f'DELETE FROM public.{table}')
+
+    await database.GuildTable().save_many([
+        database.Guild(guild.id, None, None, None, None, **dict(zip(ROLE_COLUMNS, guild.role_map)))
+        for guild in guilds
+    ])
+    await database.UserTable().save_many([database.User(discord_id_of(i), i + 1, i % 4) for i in range(users)])
+
+
+async def probe_interactions(users: int, latencies: list[float], interval: float = 0.05) -> None:
+    """
+    Times a /user view style lookup every now and then while the cycle runs, until cancelled.
+    Shows how much the cycle slows down commands that share the event loop and database pool with it
+
+    Parameters
+    ----------
+    users (int): Number of registered users
+    latencies (list[float]): List the latencies are added to, in seconds
+    interval (float): Seconds between lookups
+    """
+
+    for i in itertools.count():
+        await asyncio.sleep(interval)
+
+        start = perf_counter()
+        user = await database.UserTable().get(discord_id_of(i % users))
+        await OsuApi.get_user(user.osu_id, Gamemode.from_id(user.gamemode), max_age=timedelta(minutes=5))
+        latencies.append(perf_counter() - start)
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Nearest-rank percentile
+
+    Parameters
+    ----------
+    values (list[float]): The values
+    percent (float): The percentile to get, from 0 to 100
+
+    Returns
+    ----------
+    float: The percentile. 0 if there are no values
+    """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """
+    Seeds the database and times one run of the rank update cycle
+
+    Parameters
+    ----------
+    args (argparse.Namespace): Command line arguments. Only a single user count is used
+
+    Returns
+    ----------
+    dict: The results
+    """
+
+    users = args.users[0]
+
+    fake_osu = FakeOsuApi(latency=args.latency, rate_limit_ratio=args.rate_limit_ratio)
+    OsuApi.base_url = await fake_osu.start()
+
+    database.db_config['engine'] = args.engine
+    database.db_config['dbname'] = args.dbname
+    database.db_config['path'] = args.path
+    await database.Database.open_engine()
+    await database.Database().init_db()
+    await OsuApi.open_session()
+
+    guilds = build_guilds(users, args.guilds, args.edit_latency)
+    await seed(users, guilds)
+
+    bot = FakeBot(guilds, {
+        'slots': 1,  # Every user in a single run
+        'workers': args.workers,
+        'requests_per_second': args.requests_per_second,
+        'role_edits_per_second': args.role_edits_per_second
+    })
+    cog = RankUpdate(bot)
+
+    latencies = []
+    probe = asyncio.create_task(probe_interactions(users, latencies))
+    try:
+        start = perf_counter()
+        await cog.update_ranks()
+        elapsed = perf_counter() - start
+    finally:
+        probe.cancel()
+        cog.update_ranks.cancel()
+        await OsuApi.close_session()
+        await database.Database.close_engine()
+        await fake_osu.stop()
+
+    return {
+        'users': users,
+        'guilds': args.guilds,
+        'members': sum(len(guild.member_map) for guild in guilds),
+        'seconds': round(elapsed, 3),
+        'users_per_second': round(users / elapsed, 1),
+        'api_calls_per_user': round(fake_osu.user_requests / users, 3),
+        'rate_limited': fake_osu.rate_limited,
+        'role_edits': sum(guild.role_edits for guild in guilds),
+        'interaction_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'interaction_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KiB on Linux
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the rank update cycle end to end')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Registered user counts to benchmark')
+    parser.add_argument('--guilds', type=int, default=10, help='Number of guilds the users are spread over')
+    parser.add_argument('--workers', type=int, default=10, help='Concurrent members in the cycle')
+    parser.add_argument('--requests-per-second', type=float, default=10000,
+                        help='osu! request rate limit. The real limit is 20, which would only measure the limiter')
+    parser.add_argument('--role-edits-per-second', type=float, default=10000, help='Role edit rate per guild')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every osu! request takes')
+    parser.add_argument('--edit-latency', type=float, default=0.0, help='Seconds every role edit takes')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='Fraction of osu! requests answered 429')
+    parser.add_argument('--engine', choices=('postgres', 'sqlite'), default='postgres', help='Storage engine')
+    parser.add_argument('--dbname', default='osu_rank_tracker_benchmark',
+                        help='Postgres database to seed. Uses the host and credentials from the config. Gets wiped!')
+    parser.add_argument('--path', default='benchmark.db', help='SQLite database file to seed. Gets wiped!')
+    parser.add_argument('--output', type=Path, help='Also write the results as JSON to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.getLogger('benchmark').addHandler(logging.NullHandler())
+    logging.getLogger('benchmark').propagate = False
+
+    if args.child:
+        print(json.dumps(asyncio.run(run(args))))
+        return
+
+    # Every user count in a fresh process, so peak RSS isn't carried over between them
+    results = []
+    for users in args.users:
+        command = [sys.executable, __file__, *strip_users(sys.argv[1:]), '--users', str(users), '--child']
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+        result = results[-1]
+        print(f'{result["users"]:>7} users | {result["seconds"]:>8.2f} s | '
+              f'{result["users_per_second"]:>9.1f} users/s | {result["api_calls_per_user"]:.3f} API calls/user | '
+              f'{result["role_edits"]:>7} role edits | {result["peak_rss_mb"]:>7.1f} MB peak RSS')
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=4))
+
+
+def strip_users(args: list[str]) -> list[str]:
+    """
+    Removes --users and its values from a list of command line arguments
+
+    Parameters
+    ----------
+    args (list[str]): Command line arguments
+
+    Returns
+    ----------
+    list[str]: The arguments without --users
+    """
+
+    stripped = []
+    skipping = False
+    for arg in args:
+        if arg == '--users':
+            skipping = True
+        elif skipping and not arg.startswith('--'):
+            continue
+        else:
+            skipping = False
+            stripped.append(arg)
+    return stripped
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+
+class FakeRole:
+    """Stand-in for discord.Role"""
+
+    def __init__(self, id: int, default: bool = False):
+        self.id = id
+        self.default = default
+
+    def is_default(self) -> bool:
+        return self.default
+
+
+class FakeGuild:
+    """Stand-in for discord.Guild with just what the rank update cycle touches"""
+
+    def __init__(self, id: int, role_ids: list[int], edit_latency: float = 0.0):
+        """
+        Parameters
+        ----------
+        id (int): The guild ID
+        role_ids (list[int]): IDs of the guild's roles
+        edit_latency (float): Seconds every member edit takes, to stand in for Discord's round trip
+        """
+
+        self.id = id
+        self.default_role = FakeRole(id, default=True)
+        self.role_map = {role_id: FakeRole(role_id) for role_id in role_ids}
+        self.member_map: dict[int, FakeMember] = {}
+        self.edit_latency = edit_latency
+        self.role_edits = 0
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self.member_map.values())
+
+    def get_role(self, id: int) -> FakeRole | None:
+        return self.role_map.get(id)
+
+    def get_member(self, id: int) -> FakeMember | None:
+        return self.member_map.get(id)
+
+    def add_member(self, id: int) -> FakeMember:
+        member = self.member_map[id] = FakeMember(id, self)
+        return member
+
+
+class FakeMember:
+    """Stand-in for discord.Member"""
+
+    def __init__(self, id: int, guild: FakeGuild):
+        self.id = id
+        self.guild = guild
+        self.bot = False
+        self.roles = [guild.default_role]
+
+    async def edit(self, roles: list[FakeRole], reason: str = None) -> None:
+        if self.guild.edit_latency:
+            await asyncio.sleep(self.guild.edit_latency)
+        self.roles = [self.guild.default_role, *roles]
+        self.guild.role_edits += 1
+
+
+class FakeBot:
+    """Stand-in for the bot with just what the RankUpdate cog touches"""
+
+    def __init__(self, guilds: list[FakeGuild], rank_update: dict):
+        """
+        Parameters
+        ----------
+        guilds (list[FakeGuild]): The guilds the bot is in
+        rank_update (dict): The rank_update config section
+        """
+
+        self.guild_map = {guild.id: guild for guild in guilds}
+        self.rank_update = rank_update
+        self.logger = logging.getLogger('benchmark')
+        self.ready = asyncio.Event()  # Never set, so the cog's own loop never starts a run behind our back
+
+    @property
+    def guilds(self) -> list[FakeGuild]:
+        return list(self.guild_map.values())
+
+    def get_guild(self, id: int) -> FakeGuild | None:
+        return self.guild_map.get(id)
+
+    async def wait_until_ready(self) -> None:
+        await self.ready.wait()
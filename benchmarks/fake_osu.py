@@ -0,0 +1,106 @@
+import asyncio
+import random
+
+from aiohttp import web
+
+COUNTRIES = ('NO', 'SE', 'DK', 'FI', 'US', 'DE')
+
+
+def fake_user(osu_id: int, mode: str) -> dict:
+    """
+    Builds the parts of an osu! API user that the bot reads. The same ID always gets the same user
+
+    Parameters
+    ----------
+    osu_id (int): The osu! user ID
+    mode (str): The gamemode URL name
+
+    Returns
+    ----------
+    dict: The user data
+    """
+
+    # Spread ranks over every digit role, with most players in the higher ones like on osu!
+    rank = 1 + (osu_id * 2654435761) % 2_000_000
+    return {
+        'id': osu_id,
+        'username': f'player{osu_id}',
+        'country_code': COUNTRIES[osu_id % len(COUNTRIES)],
+        'country': {'code': COUNTRIES[osu_id % len(COUNTRIES)]},
+        'playmode': mode,
+        'statistics': {
+            'global_rank': rank,
+            'pp': round(20000 / (rank ** 0.25), 2)
+        }
+    }
+
+
+class FakeOsuApi:
+    """Local stand-in for the osu! API endpoints the rank update cycle uses"""
+
+    def __init__(self, latency: float = 0.0, rate_limit_ratio: float = 0.0, retry_after: int = 1):
+        """
+        Parameters
+        ----------
+        latency (float): Seconds every user request takes
+        rate_limit_ratio (float): Fraction of user requests answered with 429
+        retry_after (int): Retry-After sent with 429 responses
+        """
+
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(0)
+
+        self.token_requests = 0
+        self.user_requests = 0
+        self.rate_limited = 0
+
+        self.app = web.Application()
+        self.app.router.add_post('/oauth/token', self.token)
+        self.app.router.add_get('/api/v2/users/{user}/{mode}', self.user)
+        self.runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        """
+        Starts serving on a free local port
+
+        Returns
+        ----------
+        str: The base URL to point OsuApi at
+        """
+
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self) -> None:
+        """
+        Stops serving
+        """
+
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.token_requests += 1
+        return web.json_response({'access_token': 'benchmark', 'token_type': 'Bearer', 'expires_in': 86400})
+
+    async def user(self, request: web.Request) -> web.Response:
+        self.user_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+
+        try:
+            osu_id = int(request.match_info['user'])
+        except ValueError:
+            return web.Response(status=404)
+        return web.json_response(fake_user(osu_id, request.match_info['mode']))
@@ -0,0 +1,141 @@
+"""
+Microbenchmarks of the per-user CPU work in the rank update cycle.
+
+Times the rank to role ladder, the role diff, gamemode lookups and the dataclass row conversions
+the table layer does for every user. Run from the repository root with a config in place:
+
+    python benchmarks/micro.py --baseline benchmarks/baselines/micro.json
+
+Results can be saved with --output and compared against an earlier run with --baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import timeit
+from dataclasses import astuple
+from pathlib import Path
+from time import perf_counter
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+from fake_discord import FakeGuild  # noqa E402
+
+from cogs.utils import database  # noqa E402
+from cogs.utils.osu_api import Gamemode, OsuApi, OsuUserSnapshot  # noqa E402
+
+ROLE_COLUMNS = (
+    'role_1_digit', 'role_2_digit', 'role_3_digit', 'role_4_digit', 'role_5_digit', 'role_6_digit', 'role_7_digit',
+    'role_standard', 'role_taiko', 'role_ctb', 'role_mania'
+)
+
+GUILD_ROW = (1, ['NO', 'SE'], [2, 3], None, None, *range(100, 111))
+USER_ROW = (100000000000000000, 1, 0)
+
+
+def time_sync(statement, repeat: int) -> float:
+    """
+    Times a function with timeit
+
+    Parameters
+    ----------
+    statement (Callable): The function to time
+    repeat (int): Number of timing runs. The fastest one is used
+
+    Returns
+    ----------
+    float: Nanoseconds per call
+    """
+
+    timer = timeit.Timer(statement)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def time_async(coroutine_function, repeat: int, number: int = 10000) -> float:
+    """
+    Times a coroutine function by awaiting it in a loop
+
+    Parameters
+    ----------
+    coroutine_function (Callable[[], Awaitable]): The coroutine function to time
+    repeat (int): Number of timing runs. The fastest one is used
+    number (int): Awaits per timing run
+
+    Returns
+    ----------
+    float: Nanoseconds per call
+    """
+
+    async def run() -> float:
+        start = perf_counter()
+        for _ in range(number):
+            await coroutine_function()
+        return perf_counter() - start
+
+    return min(asyncio.run(run()) for _ in range(repeat)) / number * 1e9
+
+
+def benchmarks() -> dict:
+    """
+    Builds the benchmarks
+
+    Returns
+    ----------
+    dict: Benchmark name and its sync function, or (coroutine function, True) for async ones
+    """
+
+    fake_guild = FakeGuild(1, list(range(100, 111)))
+    guild = database.Guild(1, None, None, None, None, **dict(zip(ROLE_COLUMNS, fake_guild.role_map)))
+    gamemode = Gamemode.from_id(0)
+
+    # Already has the right roles, so only the ladder and the diff are timed, not an edit
+    member = fake_guild.add_member(USER_ROW[0])
+    snapshot = OsuUserSnapshot(id=1, country_code='NO', global_rank=4321, pp=5000.0)
+    member.roles = [fake_guild.default_role, fake_guild.get_role(guild.role_4_digit),
+                    fake_guild.get_role(guild.role_standard)]
+
+    guild_row = database.Guild(*GUILD_ROW)
+    user_row = database.User(*USER_ROW)
+    guild_rows = [GUILD_ROW] * 1000
+
+    return {
+        'update_user_rank_unchanged': (lambda: OsuApi.update_user_rank(guild, member, snapshot, gamemode), True),
+        'get_roles_to_remove': lambda: OsuApi._OsuApi__get_roles_to_remove(['role_4_digit', 'role_standard']),
+        'gamemode_from_id': lambda: Gamemode.from_id(2),
+        'gamemode_from_name': lambda: Gamemode.from_name('mania'),
+        'guild_astuple': lambda: astuple(guild_row),
+        'user_astuple': lambda: astuple(user_row),
+        'guild_hydrate_1000_rows': lambda: tuple(database.Guild(*row) for row in guild_rows),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Microbenchmark the per-user work of the rank update cycle')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs per benchmark. The fastest one is used')
+    parser.add_argument('--output', type=Path, help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', type=Path, help='Compare against results saved with --output')
+    args = parser.parse_args()
+
+    results = {}
+    for name, benchmark in benchmarks().items():
+        if isinstance(benchmark, tuple):
+            results[name] = time_async(benchmark[0], args.repeat)
+        else:
+            results[name] = time_sync(benchmark, args.repeat)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    for name, ns in results.items():
+        line = f'{name:<30} {ns:>12.1f} ns'
+        if name in baseline:
+            line += f' {(ns - baseline[name]) / baseline[name]:>+8.1%} vs baseline'
+        print(line)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({name: round(ns, 1) for name, ns in results.items()}, indent=4) + '\n')
+
+
+if __name__ == '__main__':
+    main()
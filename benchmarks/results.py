@@ -0,0 +1,238 @@
+"""
+Keeps a history of benchmark results and compares runs, to catch performance regressions before deploying.
+
+Record one or more result files written with --output by cycle.py or micro.py. Every file counts as one sample,
+so recording repeated runs together lets the comparison tell noise from real changes:
+
+    python benchmarks/micro.py --output run1.json
+    python benchmarks/micro.py --output run2.json
+    python benchmarks/results.py record micro run1.json run2.json
+
+Then compare two recorded runs. Exits with 1 if any metric regressed past the threshold:
+
+    python benchmarks/results.py compare micro --threshold 5
+"""
+
+import argparse
+import json
+import math
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+DEFAULT_STORE = Path(__file__).resolve().parent / 'history.json'
+
+
+def git_revision() -> tuple[str, bool]:
+    """
+    Gets the checked out git revision
+
+    Returns
+    ----------
+    tuple[str, bool]: The commit hash and whether there are uncommitted changes. ('unknown', False) outside of git
+    """
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return revision.stdout.strip(), bool(status.stdout.strip())
+
+
+def flatten(result: dict | list) -> dict[str, float]:
+    """
+    Turns a result file into metric name and value pairs
+
+    Parameters
+    ----------
+    result (dict | list): Results from micro.py (a dict of timings) or cycle.py (a list with one dict per user count)
+
+    Returns
+    ----------
+    dict[str, float]: Metric name and value
+    """
+
+    if isinstance(result, dict):
+        return {f'{name}_ns': value for name, value in result.items()}
+
+    metrics = {}
+    for size in result:
+        for name, value in size.items():
+            if name not in ('users', 'guilds', 'members'):
+                metrics[f'{size["users"]}_users.{name}'] = value
+    return metrics
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith('per_second')
+
+
+def load(store: Path) -> list[dict]:
+    return json.loads(store.read_text()) if store.exists() else []
+
+
+def record(store: Path, benchmark: str, files: list[Path]) -> dict:
+    """
+    Adds a run to the store
+
+    Parameters
+    ----------
+    store (Path): The history file
+    benchmark (str): Name of the benchmark, e.g. cycle or micro
+    files (list[Path]): Result files. Each one is a sample of every metric
+
+    Returns
+    ----------
+    dict: The recorded run
+    """
+
+    samples: dict[str, list[float]] = {}
+    for file in files:
+        for metric, value in flatten(json.loads(file.read_text())).items():
+            samples.setdefault(metric, []).append(value)
+
+    revision, dirty = git_revision()
+    run = {
+        'benchmark': benchmark,
+        'revision': revision,
+        'dirty': dirty,
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'samples': samples
+    }
+
+    runs = load(store)
+    runs.append(run)
+    store.write_text(json.dumps(runs, indent=4) + '\n')
+    return run
+
+
+def find_run(runs: list[dict], benchmark: str, ref: str) -> dict:
+    """
+    Finds a recorded run by git revision prefix, or by position like -1 for the latest run
+
+    Parameters
+    ----------
+    runs (list[dict]): Every recorded run
+    benchmark (str): Name of the benchmark
+    ref (str): Revision prefix or negative index
+
+    Returns
+    ----------
+    dict: The run. The latest one if a revision has several
+
+    Raises
+    ----------
+    SystemExit: If there's no such run
+    """
+
+    runs = [run for run in runs if run['benchmark'] == benchmark]
+
+    # Revisions can be all digits, so only negative numbers are positions
+    if ref.startswith('-'):
+        try:
+            index = int(ref)
+        except ValueError:
+            index = 0
+        if index < 0 and -index <= len(runs):
+            return runs[index]
+    else:
+        matches = [run for run in runs if run['revision'].startswith(ref)]
+        if matches:
+            return matches[-1]
+
+    sys.exit(f'No {benchmark} run found for {ref}')
+
+
+def compare(base: dict, head: dict, threshold: float, sigmas: float) -> list[tuple[str, float, float, float, str]]:
+    """
+    Compares every metric the runs have in common.
+    A metric regressed if it got worse by more than the threshold, and the difference is bigger than the noise
+    between samples. With a single sample per run there's no noise estimate, so only the threshold applies
+
+    Parameters
+    ----------
+    base (dict): The run to compare against
+    head (dict): The new run
+    threshold (float): Percentage a metric has to get worse by to count as a regression
+    sigmas (float): Standard errors the difference has to exceed to not be considered noise
+
+    Returns
+    ----------
+    list[tuple[str, float, float, float, str]]: Metric, base mean, head mean, change and verdict
+    """
+
+    rows = []
+    for metric in sorted(base['samples'].keys() & head['samples'].keys()):
+        base_samples, head_samples = base['samples'][metric], head['samples'][metric]
+        base_mean, head_mean = statistics.fmean(base_samples), statistics.fmean(head_samples)
+
+        change = (head_mean - base_mean) / base_mean if base_mean else 0.0
+        worse = -change if higher_is_better(metric) else change
+
+        noise = 0.0
+        if len(base_samples) > 1 and len(head_samples) > 1:
+            noise = sigmas * math.sqrt(statistics.variance(base_samples) / len(base_samples) +
+                                       statistics.variance(head_samples) / len(head_samples))
+        significant = abs(head_mean - base_mean) > noise
+
+        if worse * 100 > threshold and significant:
+            verdict = 'REGRESSION'
+        elif -worse * 100 > threshold and significant:
+            verdict = 'improved'
+        else:
+            verdict = ''
+        rows.append((metric, base_mean, head_mean, change, verdict))
+
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Record benchmark results and compare runs')
+    parser.add_argument('--store', type=Path, default=DEFAULT_STORE, help='History file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record a run')
+    record_parser.add_argument('benchmark', help='Name of the benchmark, e.g. cycle or micro')
+    record_parser.add_argument('files', type=Path, nargs='+', help='Result files, one per repetition')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two runs')
+    compare_parser.add_argument('benchmark', help='Name of the benchmark, e.g. cycle or micro')
+    compare_parser.add_argument('base', nargs='?', default='-2', help='Revision prefix or index. Defaults to -2')
+    compare_parser.add_argument('head', nargs='?', default='-1', help='Revision prefix or index. Defaults to -1')
+    compare_parser.add_argument('--threshold', type=float, default=5, help='Allowed slowdown in percent')
+    compare_parser.add_argument('--sigmas', type=float, default=2, help='Standard errors a change must exceed')
+
+    subparsers.add_parser('list', help='List recorded runs')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        run = record(args.store, args.benchmark, args.files)
+        print(f'Recorded {args.benchmark} run for {run["revision"][:10]}{" (dirty)" if run["dirty"] else ""} ' +
+              f'with {len(args.files)} sample(s)')
+
+    elif args.command == 'list':
+        for run in load(args.store):
+            samples = max((len(values) for values in run['samples'].values()), default=0)
+            print(f'{run["recorded_at"]}  {run["benchmark"]:<10} {run["revision"][:10]}' +
+                  f'{" (dirty)" if run["dirty"] else "        "}  {samples} sample(s)')
+
+    elif args.command == 'compare':
+        runs = load(args.store)
+        base = find_run(runs, args.benchmark, args.base)
+        head = find_run(runs, args.benchmark, args.head)
+
+        rows = compare(base, head, args.threshold, args.sigmas)
+        print(f'{args.benchmark}: {base["revision"][:10]} -> {head["revision"][:10]}')
+        for metric, base_mean, head_mean, change, verdict in rows:
+            print(f'{metric:<40} {base_mean:>14.2f} {head_mean:>14.2f} {change:>+8.1%}  {verdict}')
+
+        if any(verdict == 'REGRESSION' for *_, verdict in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ import requests
 from discord.ext import commands
 
 from cogs.utils import embed_templates
+from cogs.utils.osu_api import OsuApi
+from cogs.utils.profiling import Profile
 
 
 class DevTools(commands.Cog):
@@ -148,6 +150,123 @@ class DevTools(commands.Cog):
         embed.add_field(name='WAN IP-address', value=f'{ip}\n{location}\n{isp}')
         await ctx.reply(embed=embed)
 
+    @commands.is_owner()
+    @commands.bot_has_permissions(embed_links=True)
+    @commands.command(name='cachestats', description='Show osu! API response cache statistics')
+    async def cachestats(self, ctx: commands.Context):
+        """
+        Sends the hit, miss and eviction counters of the osu! user cache
+
+        Parameters
+        ----------
+        ctx (commands.Context): Context object
+        """
+
+        cache = OsuApi.user_cache
+        lookups = cache.hits + cache.misses
+        hit_rate = f'{cache.hits / lookups:.1%}' if lookups else 'N/A'
+
+        embed = discord.Embed(color=ctx.me.color, title='osu! user cache')
+        embed.add_field(name='Entries', value=f'{len(cache)}/{cache.max_size}')
+        embed.add_field(name='Hits', value=cache.hits)
+        embed.add_field(name='Misses', value=cache.misses)
+        embed.add_field(name='Evictions', value=cache.evictions)
+        embed.add_field(name='Hit rate', value=hit_rate)
+        await ctx.reply(embed=embed)
+
+    @commands.is_owner()
+    @commands.bot_has_permissions(embed_links=True)
+    @commands.group(name='profile', description='Profile the bot')
+    async def profile(self, ctx: commands.Context):
+        """
+        Profiling commands
+
+        Parameters
+        ----------
+        ctx (commands.Context): Context object
+        """
+
+        if not ctx.invoked_subcommand:
+            await ctx.reply_help(ctx.command)
+
+    @profile.command(name='cycle')
+    async def profile_cycle(self, ctx: commands.Context, top: int = 15):
+        """
+        Profiles the next run of the rank update cycle
+
+        Parameters
+        ----------
+        ctx (commands.Context): Context object
+        top (int): How many functions to list in the summary
+        """
+
+        if not (rank_update := self.bot.get_cog('RankUpdate')):
+            return await ctx.reply(embed=embed_templates.error_warning('The rank update cog isn\'t loaded'))
+        if not rank_update.update_ranks.is_running() or not (next_iteration := rank_update.update_ranks.next_iteration):
+            return await ctx.reply(embed=embed_templates.error_warning('The rank update cycle isn\'t running'))
+        if rank_update.armed_profile or Profile.running:
+            return await ctx.reply(embed=embed_templates.error_warning('A profile is already armed or running'))
+
+        profile = rank_update.armed_profile = Profile('cycle')
+        next_run = discord.utils.format_dt(next_iteration, style='R')
+        await ctx.reply(embed=discord.Embed(color=ctx.me.color, description=f'Profiling the next cycle {next_run}'))
+
+        # The profile is thrown away if the cog is reloaded or the loop stopped before the next run,
+        # so give up once the run should have finished. A run taking longer than a slot is overdue anyway
+        timeout = (next_iteration - discord.utils.utcnow() + rank_update.slot_length).total_seconds() + 60
+        try:
+            await asyncio.wait_for(profile.finished, max(timeout, 60))
+        except asyncio.TimeoutError:
+            if rank_update.armed_profile is profile:
+                rank_update.armed_profile = None
+            return await ctx.reply(embed=embed_templates.error_warning('The profiled cycle never finished'))
+
+        await self.__send_profile(ctx, profile, top)
+
+    @profile.command(name='window')
+    async def profile_window(self, ctx: commands.Context, seconds: commands.Range[int, 1, 600], top: int = 15):
+        """
+        Profiles everything the bot does for a while
+
+        Parameters
+        ----------
+        ctx (commands.Context): Context object
+        seconds (int): How long to profile for
+        top (int): How many functions to list in the summary
+        """
+
+        # Only one profile can run at a time, and an armed cycle profile could start at any moment
+        rank_update = self.bot.get_cog('RankUpdate')
+        if Profile.running or (rank_update and rank_update.armed_profile):
+            return await ctx.reply(embed=embed_templates.error_warning('A profile is already armed or running'))
+
+        profile = Profile('window')
+        profile.start()
+        try:
+            await ctx.reply(embed=discord.Embed(color=ctx.me.color, description=f'Profiling for {seconds} seconds'))
+            await asyncio.sleep(seconds)
+        finally:
+            profile.stop()
+
+        await self.__send_profile(ctx, profile, top)
+
+    async def __send_profile(self, ctx: commands.Context, profile: Profile, top: int):
+        """
+        Sends a profile's summary and its pstats file
+
+        Parameters
+        ----------
+        ctx (commands.Context): Context object
+        profile (Profile): The finished profile
+        top (int): How many functions to list in the summary
+        """
+
+        summary = profile.summary(top)
+        if len(summary) > 1900:
+            summary = summary[:1900].rsplit('\n', 1)[0]
+
+        await ctx.reply(f'```\n{summary}\n```', file=discord.File(profile.path))
+
     @commands.is_owner()
     @commands.bot_has_permissions(embed_links=True)
     @commands.group(name='cogs', description='Manage cogs')
@@ -6,6 +6,7 @@ from discord.ext import commands
 
 from cogs.utils import embed_templates
 from cogs.utils.misc_utils import ignore_exception
+from cogs.utils.osu_api import OsuApiError
 
 
 class Errors(commands.Cog):
@@ -149,25 +150,45 @@ class Errors(commands.Cog):
             permissions = ', '.join(error.missing_perms)
             embed = embed_templates.error_warning('I\'m missing the following permissions:\n\n' +
                                                   f'```\n{permissions}\n```')
-            return await interaction.response.send_message(embed=embed)
+            return await self.__respond(interaction, embed)
 
         elif isinstance(error, app_commands.MissingPermissions):
             permissions = ', '.join(error.missing_perms)
             embed = embed_templates.error_warning('You\'re missing the following permissions:\n\n' +
                                                   f'```\n{permissions}\n```')
-            return await interaction.response.send_message(embed=embed)
+            return await self.__respond(interaction, embed)
 
         elif isinstance(error, app_commands.CommandOnCooldown):
             embed = embed_templates.error_warning('The command has just been invoked\n' +
                                                   f'Try again in `{error.retry_after:.1f}` seconds.')
-            return await interaction.response.send_message(embed=embed)
+            return await self.__respond(interaction, embed)
+
+        elif isinstance(getattr(error, 'original', error), OsuApiError):
+            embed = embed_templates.error_warning('Could not reach osu! right now. Try again in a bit')
+            return await self.__respond(interaction, embed)
 
         embed = embed_templates.error_fatal('An unknown error occurred!')
-        await interaction.response.send_message(embed=embed)
+        await self.__respond(interaction, embed)
 
         # Log full exception to file
         self.bot.logger.error(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
 
+    @staticmethod
+    async def __respond(interaction: discord.Interaction, embed: discord.Embed):
+        """
+        Reply to an interaction, whether or not the command has already responded or deferred
+
+        Parameters
+        ----------
+        interaction (discord.Interaction): Slash command context object
+        embed (discord.Embed): The embed to reply with
+        """
+
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed)
+        else:
+            await interaction.response.send_message(embed=embed)
+
 
 async def setup(bot: commands.Bot):
     """
@@ -1,12 +1,24 @@
 import asyncio
 import dataclasses
-from datetime import time
+import json
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
 
 import discord
 from discord.ext import commands, tasks
 
 import cogs.utils.database as database
-from cogs.utils.osu_api import Gamemode, OsuApi
+from cogs.utils import metrics
+from cogs.utils.cache import SnapshotStore
+from cogs.utils.osu_api import Gamemode, OsuApi, OsuApiError, OsuUserSnapshot
+from cogs.utils.profiling import Profile
+from cogs.utils.rate_limiter import TokenBucket
+from cogs.utils.role_dispatcher import RoleEditDispatcher
+from cogs.utils.scheduling import UpdateScheduler
 
 
 class RankUpdate(commands.Cog):
@@ -14,68 +26,382 @@ class RankUpdate(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = UpdateScheduler.from_config(bot.rank_update)
+
+        # The update period is split into slots and every user is given a fixed slot based on their ID.
+        # Each run of the loop only handles one slot, which spreads the load evenly over the whole period
+        self.slots = bot.rank_update.get('slots', 288)
+        self.slot_length = timedelta(hours=bot.rank_update.get('period_hours', 24)) / self.slots
+        self.current_slot = None
+        self.last_slot = None  # Counted from the epoch rather than wrapping, so skipped slots can be told apart
+
+        # Identifies this process' leases in the job table shared with other bot processes
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease = timedelta(seconds=bot.rank_update.get('lease_seconds', 60))
+
+        # Profile armed from dev_tools for the next run of the cycle
+        self.armed_profile: Profile | None = None
+
+        self.update_ranks.change_interval(seconds=self.slot_length.total_seconds())
         self.update_ranks.start()
-        self.rank_cache = {}
+
+    async def cog_load(self):
+        self.registration_listener = asyncio.create_task(self.__listen_for_registrations())
 
     def cog_unload(self):
         self.update_ranks.cancel()
+        self.registration_listener.cancel()
 
-    @tasks.loop(time=time(hour=0, minute=0))
+    @tasks.loop(minutes=5)
     async def update_ranks(self):
         """
-        Update the ranks of all users in the database
+        Run the rank update cycle. Profiles the run if a profile has been armed
         """
 
-        self.bot.logger.info('Initiating automatic rank update...')
+        if profile := self.armed_profile:
+            self.armed_profile = None
+            profile.start()
+
+        try:
+            await self.__update_ranks()
+        except Exception:
+            # An error escaping would stop the loop for good. Unfinished jobs keep their leases until they expire,
+            # and the slot isn't marked as done, so the next run picks up where this one failed
+            self.bot.logger.exception('Rank update failed. Retrying on the next run')
+        finally:
+            if profile:
+                profile.stop()
+
+    async def __update_ranks(self):
+        """
+        Update the ranks of the users in the current slot, and of any user whose scheduled rank check is due.
+        Users whose rank isn't due for a check keep their stored rank
+        """
+
+        start = perf_counter()
+
+        # Derived from the clock so the rotation picks up where it left off after a restart. If the last run overran
+        # into the next slots they're caught up on now, instead of their members waiting for a whole rotation
+        clock_slot = int(datetime.now(timezone.utc).timestamp() // self.slot_length.total_seconds())
+        first_slot = clock_slot if self.last_slot is None else min(self.last_slot + 1, clock_slot)
+        slots = {slot % self.slots for slot in range(max(first_slot, clock_slot - self.slots + 1), clock_slot + 1)}
+        self.current_slot = clock_slot % self.slots
+
+        skipped = f' and {len(slots) - 1} skipped slot(s)' if len(slots) > 1 else ''
+        self.bot.logger.info(f'Initiating automatic rank update for slot {self.current_slot + 1}/{self.slots}' +
+                             f'{skipped}...')
 
         user_table = database.UserTable()
         guild_table = database.GuildTable()
+        state_table = database.RankStateTable()
+        job_table = database.UpdateJobTable()
+
+        # osu! allows 20 requests per second. Default to slightly below that to leave room for commands.
+        # Every bot process shares the same osu! credentials, so the budget is split between them
+        settings = self.bot.rank_update
+        limiter = TokenBucket(settings.get('requests_per_second', 18) / settings.get('processes', 1))
+        worker_count = settings.get('workers', 10)
+
+        # Every osu! account is only fetched once per cycle, no matter how many guilds it's in
+        snapshots = SnapshotStore()
+
+        # Role edits are applied per guild in the background, so a rate limited guild doesn't hold up the others
+        dispatcher = RoleEditDispatcher(settings.get('role_edits_per_second', 2))
+
+        # Queue up this slot's members in the shared job table. Every bot process does the same for the guilds
+        # it can see, and duplicates are ignored, so it doesn't matter which process gets here first
+        guilds = {guild.discord_id: guild for guild in await guild_table.get_all()
+                  if self.bot.get_guild(guild.discord_id)}
+        due = await state_table.get_due()
+
+        jobs = []
+        for guild_id in guilds:
+            members = [member.id for member in self.bot.get_guild(guild_id).members
+                       if not member.bot and (member.id in due or self.get_slot(member.id) in slots)]
+            jobs.extend((guild_id, discord_id) for discord_id in await user_table.get_many(members))
+        await job_table.enqueue(jobs)
+
+        # Bounded so we don't lease more jobs than we're about to work on
+        queue = asyncio.Queue(maxsize=worker_count * 2)
+        pending_edits: set[asyncio.Task] = set()
+        workers = [asyncio.create_task(self.__update_worker(queue, limiter, snapshots, dispatcher, job_table,
+                                                            pending_edits))
+                   for _ in range(worker_count)]
+        heartbeat = asyncio.create_task(self.__heartbeat(job_table))
+
+        # Drain the job table together with any other bot processes until there's nothing left we can work on
+        member_count = 0
+        try:
+            while True:
+                # Don't lease jobs we can't work on while osu! is unhealthy
+                await OsuApi.breaker.wait()
+                if not (claimed := await job_table.claim(self.worker_id, list(guilds), worker_count, self.lease)):
+                    break
+
+                discord_ids = [job.discord_id for job in claimed]
+                users = await user_table.get_many(discord_ids)
+                states = await state_table.get_many(discord_ids)
+
+                for job in claimed:
+                    # The bot may have left the guild, or the member may have left it, since the job was queued
+                    discord_guild = self.bot.get_guild(job.guild_id)
+                    member = discord_guild.get_member(job.discord_id) if discord_guild else None
+                    if not member or not (user := users.get(job.discord_id)):
+                        await job_table.complete(job)
+                        continue
 
-        sleep_time = 1 / 10  # Max 10 requests per second. Discord allows 50 and osu allows 20. We're playing it safe
+                    state = states.get((user.discord_id, user.gamemode))
+                    await queue.put((guilds[job.guild_id], member, user, state, job))
+                    member_count += 1
 
-        for guild in await guild_table.get_all():
-            self.bot.logger.info(f'Updating ranks for guild - {guild.discord_id}...')
+            await queue.join()
+            await asyncio.gather(*pending_edits)
+        finally:
+            heartbeat.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(heartbeat, *workers, return_exceptions=True)
+            await dispatcher.close()
+            await asyncio.gather(*pending_edits, return_exceptions=True)
 
-            if not (discord_guild := self.bot.get_guild(guild.discord_id)):
-                continue
+        self.last_slot = clock_slot
 
-            for member in discord_guild.members:
-                if member.bot or not (user := await user_table.get(member.id)):
-                    continue
+        self.bot.logger.info(f'Rank update for slot {self.current_slot + 1}/{self.slots}{skipped} complete! ' +
+                             f'Members checked: {member_count}, osu! users looked up: {snapshots.misses}, ' +
+                             f'reused across guilds: {snapshots.hits}, roles edited: {dispatcher.edits}')
 
-                self.bot.logger.info(f'Checking/Updating rank of user - {user.discord_id}...')
+        metrics.CYCLE_DURATION.observe(perf_counter() - start)
+        metrics.CYCLE_SNAPSHOTS.labels('hit').inc(snapshots.hits)
+        metrics.CYCLE_SNAPSHOTS.labels('miss').inc(snapshots.misses)
 
-                gamemode = Gamemode.from_id(user.gamemode)
+    async def __heartbeat(self, job_table: database.UpdateJobTable):
+        """
+        Keeps the leases on this process' jobs alive until cancelled
 
-                # If rank is not cached, fetch it and cache it
-                if not (rank := self.rank_cache.get(user.discord_id)):
-                    # Get osu user and verify it exists
-                    if not (osu_user := await OsuApi.get_user(user.osu_id, gamemode)):
-                        continue
-                    # Get the user's rank and verify it exists
-                    if not (rank := osu_user.get('statistics', {}).get('global_rank')):
-                        continue
-                    self.rank_cache[user.discord_id] = rank
+        Parameters
+        ----------
+        job_table (database.UpdateJobTable): The shared job table
+        """
+
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                await job_table.heartbeat(self.worker_id, self.lease)
+            except Exception:
+                # Keep trying. A lease is only lost if every renewal until it expires fails
+                self.bot.logger.exception('Failed to renew job leases')
+
+    def get_slot(self, discord_id: int) -> int:
+        """
+        Get the update slot of a user. The same user always ends up in the same slot
+
+        Parameters
+        ----------
+        discord_id (int): The Discord ID
+
+        Returns
+        ----------
+        int: The slot index
+        """
+
+        # Snowflakes aren't evenly distributed in their low bits, so hash them first
+        return zlib.crc32(discord_id.to_bytes(8, 'little')) % self.slots
+
+    async def __update_worker(
+        self,
+        queue: asyncio.Queue,
+        limiter: TokenBucket,
+        snapshots: SnapshotStore,
+        dispatcher: RoleEditDispatcher,
+        job_table: database.UpdateJobTable,
+        pending_edits: set[asyncio.Task]
+    ):
+        """
+        Consumes members from the queue and updates their ranks until cancelled
+
+        Parameters
+        ----------
+        queue (asyncio.Queue): Queue of (database.Guild, discord.Member, database.User, database.RankState,
+                               database.UpdateJob) tuples
+        limiter (TokenBucket): Rate limiter for requests to the osu! API
+        snapshots (SnapshotStore): osu! users fetched during this cycle
+        dispatcher (RoleEditDispatcher): Applies role edits per guild
+        job_table (database.UpdateJobTable): The shared job table
+        pending_edits (set[asyncio.Task]): Tasks that complete jobs once their queued role edits are applied
+        """
+
+        while True:
+            guild, member, user, state, job = await queue.get()
+            try:
+                update = await self.__update_member(guild, member, user, state, limiter, snapshots, dispatcher)
+            except OsuApiError as e:
+                # osu! being down says nothing about the user, so never give up on them for it
+                self.bot.logger.warning(f'Could not fetch user - {user.discord_id}. Retrying later - {e}')
+                metrics.CYCLE_USERS.labels('failed').inc()
+                await job_table.release(job, self.lease)
+            except Exception:
+                self.bot.logger.exception(f'Failed to update rank of user - {user.discord_id}')
+                metrics.CYCLE_USERS.labels('failed').inc()
+                await self.__retry_or_drop(job, job_table)
+            else:
+                metrics.CYCLE_USERS.labels('processed' if update else 'skipped').inc()
+                if update and (edit := update.get('edit')):
+                    # The job isn't done until Discord has applied the edit, so it must not be completed yet
+                    task = asyncio.create_task(self.__complete_after_edit(edit, job, job_table))
+                    pending_edits.add(task)
+                    task.add_done_callback(pending_edits.discard)
+                else:
+                    await job_table.complete(job)
+            finally:
+                queue.task_done()
+
+    async def __complete_after_edit(self, edit: asyncio.Future, job: database.UpdateJob,
+                                    job_table: database.UpdateJobTable):
+        """
+        Complete a job once its queued role edit has been applied, or hand it back if the edit failed
+
+        Parameters
+        ----------
+        edit (asyncio.Future): The queued role edit
+        job (database.UpdateJob): The job the edit belongs to
+        job_table (database.UpdateJobTable): The shared job table
+        """
+
+        await asyncio.wait((edit,))
+
+        if edit.cancelled():
+            # Dropped because the cycle stopped. The job keeps its lease until it expires, then it's retried
+            return
 
-                # Update the user's rank
-                await OsuApi.update_user_rank(guild, member, osu_user, gamemode,
-                                              reason='Automatic rank update based on osu! rank')
+        if error := edit.exception():
+            self.bot.logger.error(f'Failed to edit roles of user - {job.discord_id} in guild - {job.guild_id}',
+                                  exc_info=error)
+            await self.__retry_or_drop(job, job_table)
+        else:
+            await job_table.complete(job)
 
-                await asyncio.sleep(sleep_time)
+    async def __retry_or_drop(self, job: database.UpdateJob, job_table: database.UpdateJobTable):
+        """
+        Hand a failed job back to the job table so it's retried later, unless it has failed too many times
 
-        self.rank_cache = {}  # Clear the rank cache
+        Parameters
+        ----------
+        job (database.UpdateJob): The failed job
+        job_table (database.UpdateJobTable): The shared job table
+        """
 
-        self.bot.logger.info("Rank update complete!")
+        if job.attempts >= self.bot.rank_update.get('max_attempts', 5):
+            self.bot.logger.info(f'Giving up on rank update of user - {job.discord_id} in guild - {job.guild_id}')
+            await job_table.complete(job)
+        else:
+            await job_table.release(job, self.lease)
+
+    async def __update_member(
+        self,
+        guild: database.Guild,
+        member: discord.Member,
+        user: database.User,
+        state: database.RankState | None,
+        limiter: TokenBucket,
+        snapshots: SnapshotStore,
+        dispatcher: RoleEditDispatcher
+    ) -> dict | None:
+        """
+        Update the rank of a single member in a guild
+
+        Parameters
+        ----------
+        guild (database.Guild): A fetched guild from the database
+        member (discord.Member): The member to update
+        user (database.User): The member's user entry from the database
+        state (database.RankState): The user's stored rank state, if any
+        limiter (TokenBucket): Rate limiter for requests to the osu! API
+        snapshots (SnapshotStore): osu! users fetched during this cycle
+        dispatcher (RoleEditDispatcher): Applies role edits per guild
+
+        Returns
+        ----------
+        dict: Information about the rank update, see OsuApi.update_user_rank.
+              None if the member was skipped because their osu! user or rank doesn't exist
+        """
+
+        self.bot.logger.info(f'Checking/Updating rank of user - {user.discord_id}...')
+
+        gamemode = Gamemode.from_id(user.gamemode)
+
+        # Get osu user and verify it and its rank exists
+        osu_user = await snapshots.get((user.osu_id, gamemode.id),
+                                       lambda: OsuApi.get_user_snapshot(user, gamemode, state, self.scheduler,
+                                                                        limiter=limiter))
+        if not osu_user or not osu_user.global_rank:
+            return None
+
+        # Update the user's rank
+        return await OsuApi.update_user_rank(guild, member, osu_user, gamemode,
+                                             reason='Automatic rank update based on osu! rank', dispatcher=dispatcher)
 
     @update_ranks.before_loop
     async def before_update_ranks(self):
         """
-        Schedule the update ranks task to every 12 hours at 00:00/12:00 UTC
-        Chooses the closest next time to run based on the current time
+        Make sure bot is ready before starting the rank update loop
+        """
+
+        await self.bot.wait_until_ready()
+
+    async def __listen_for_registrations(self):
+        """
+        Give newly registered users their roles as soon as the verification server reports them
         """
 
         await self.bot.wait_until_ready()
 
+        while True:
+            try:
+                async for payload in database.Database.listen(database.USER_REGISTERED_CHANNEL):
+                    await self.__on_user_registered(database.User(**json.loads(payload)))
+            except Exception:
+                self.bot.logger.exception('Stopped listening for registrations. Reconnecting...')
+                await asyncio.sleep(5)
+
+    async def __on_user_registered(self, user: database.User):
+        """
+        Update a newly registered user's rank in every guild they share with the bot
+
+        Parameters
+        ----------
+        user (database.User): The registered user
+        """
+
+        self.bot.logger.info(f'User ({user.discord_id}) registered')
+
+        if not (discord_user := self.bot.get_user(user.discord_id)) or not discord_user.mutual_guilds:
+            return
+
+        gamemode = Gamemode.from_id(user.gamemode)
+
+        try:
+            osu_user = await OsuApi.get_user_snapshot(user, gamemode, None, self.scheduler)
+        except Exception:
+            self.bot.logger.exception(f'Failed to fetch newly registered user ({user.discord_id})')
+            return
+
+        if not osu_user:
+            return
+
+        for discord_guild in discord_user.mutual_guilds:
+            try:
+                guild = await database.GuildTable().get(discord_guild.id)
+                update = await OsuApi.update_user_rank(guild, discord_guild.get_member(user.discord_id), osu_user,
+                                                       gamemode, reason='User registered')
+            except Exception:
+                self.bot.logger.exception(f'Failed to update rank of user ({user.discord_id}) ' +
+                                          f'in guild ({discord_guild.id})')
+                continue
+
+            if not update.get('success'):
+                self.bot.logger.info(f'Rank not updated for user ({user.discord_id}) in guild ({discord_guild.id}) - ' +
+                                     update['message'])
+
     @commands.Cog.listener('on_guild_join')
     async def on_guild_join(self: commands.Bot, guild: discord.Guild):
         """
@@ -116,16 +442,25 @@ class RankUpdate(commands.Cog):
         self.bot.logger.info(f'User ({member.id}) joined guild ({member.guild.id})')
 
         guild = await database.GuildTable().get(member.guild.id)
-        user = await database.UserTable().get(member.id)
-        if user:
-            osu_user = await OsuApi.get_user(user.osu_id, Gamemode.from_id(user.gamemode))
-            update = await OsuApi.update_user_rank(guild, member, osu_user, Gamemode.from_id(user.gamemode),
-                                                   reason='User joined guild')
+        if not (user := await database.UserTable().get(member.id)):
+            return
+
+        try:
+            osu_user = await OsuApi.get_user(user.osu_id, Gamemode.from_id(user.gamemode),
+                                             max_age=timedelta(minutes=10))
+        except OsuApiError as e:
+            # The member is picked up by the rank update cycle once osu! is reachable again
+            self.bot.logger.warning(f'Could not fetch user ({member.id}) on guild join - {e}')
+            return
+
+        if osu_user:
+            update = await OsuApi.update_user_rank(guild, member, OsuUserSnapshot.from_api(osu_user),
+                                                   Gamemode.from_id(user.gamemode), reason='User joined guild')
 
             if update.get('success'):
                 self.bot.logger.info(f'Updated rank of user ({member.id})')
             else:
-                self.bot.logger.info(f'Rank not updated for user ({member.id}) - {update["reason"]}')
+                self.bot.logger.info(f'Rank not updated for user ({member.id}) - {update["message"]}')
 
     @commands.Cog.listener('on_guild_role_delete')
     async def on_guild_role_delete(self, role: discord.Role):
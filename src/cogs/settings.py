@@ -1,3 +1,4 @@
+from datetime import timedelta
 from enum import Enum
 
 import discord
@@ -217,13 +218,16 @@ class Settings(commands.Cog):
         osu_user (str): The osu! user to add to the blacklist
         """
 
-        user = await OsuApi.get_user(osu_user, Gamemode.from_name('standard'))
-        user_id = user.get('id')
-        username = user.get('username')
+        # Defer, as the osu! lookup can outlast Discord's response window while osu! is having trouble
+        await interaction.response.defer()
 
+        user = await OsuApi.get_user(osu_user, Gamemode.from_name('standard'), max_age=timedelta(hours=1))
         if not user:
             embed = embed_templates.error_warning('Invalid osu! user')
-            return await interaction.response.send_message(embed=embed)
+            return await interaction.followup.send(embed=embed)
+
+        user_id = user.get('id')
+        username = user.get('username')
 
         guild_table = database.GuildTable()
         guild = await guild_table.get(interaction.guild.id)
@@ -233,7 +237,7 @@ class Settings(commands.Cog):
 
         if user.get('id') in guild.blacklisted_osu_users:
             embed = embed_templates.error_warning('User is already blacklisted!')
-            return await interaction.response.send_message(embed=embed)
+            return await interaction.followup.send(embed=embed)
 
         guild.blacklisted_osu_users.append(user_id)
         await guild_table.save(guild)
@@ -241,7 +245,7 @@ class Settings(commands.Cog):
         embed = embed_templates.success(
             f'[{username}](https://osu.ppy.sh/users/{user_id}) ({user_id}) is now blacklisted!'
         )
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     @blacklist_group.command(name='remove')
     async def blacklist_remove(self, interaction: discord.Interaction, osu_user: str):
@@ -254,20 +258,23 @@ class Settings(commands.Cog):
         osu_user (str): The osu! user to remove from the blacklist
         """
 
-        user = await OsuApi.get_user(osu_user, Gamemode.from_name('standard'))
-        user_id = user.get('id')
-        username = user.get('username')
+        # Defer for the same reason as blacklist add
+        await interaction.response.defer()
 
+        user = await OsuApi.get_user(osu_user, Gamemode.from_name('standard'), max_age=timedelta(hours=1))
         if not user:
             embed = embed_templates.error_warning('Invalid osu! user')
-            return await interaction.response.send_message(embed=embed)
+            return await interaction.followup.send(embed=embed)
+
+        user_id = user.get('id')
+        username = user.get('username')
 
         guild_table = database.GuildTable()
         guild = await guild_table.get(interaction.guild.id)
 
         if not guild.blacklisted_osu_users or user_id not in guild.blacklisted_osu_users:
             embed = embed_templates.error_warning('User is not blacklisted!')
-            return await interaction.response.send_message(embed=embed)
+            return await interaction.followup.send(embed=embed)
 
         guild.blacklisted_osu_users.remove(user_id)
         await guild_table.save(guild)
@@ -275,7 +282,7 @@ class Settings(commands.Cog):
         embed = embed_templates.success(
             f'[{username}](https://osu.ppy.sh/users/{user_id}) ({user_id}) is no longer blacklisted!'
         )
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     @blacklist_group.command(name='show')
     async def blacklist_show(self, interaction: discord.Interaction):
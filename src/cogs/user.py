@@ -1,5 +1,4 @@
-import asyncio
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 import discord
 from discord import app_commands
@@ -8,6 +7,7 @@ from discord.ext import commands, tasks
 import cogs.utils.database as database
 from cogs.utils import embed_templates
 from cogs.utils.osu_api import Gamemode, GamemodeOptions, OsuApi
+from cogs.utils.scheduling import UpdateScheduler
 
 
 class User(commands.Cog):
@@ -15,6 +15,7 @@ class User(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = UpdateScheduler.from_config(bot.rank_update)
         self.verification_cleanup.start()
 
     user_group = app_commands.Group(
@@ -28,16 +29,12 @@ class User(commands.Cog):
     @tasks.loop(minutes=2)
     async def verification_cleanup(self):
         """
-        Clean up any pending verifications that have expired. This is in case the register command fails to do so
+        Clean up any pending verifications that have expired.
+        This is in case the verification expiry scheduler misses them, e.g. when they were made by another process
         """
 
-        # Would be more efficent to query expired verifications directly, but this is fine
-        verification_table = database.VerificationTable()
-        verifications = await verification_table.get_all()
-        for verification in verifications:
-            if verification.expires < datetime.now(timezone.utc).replace(tzinfo=None):
-                self.bot.logger.info(f'Cleaning up expired verification for {verification.discord_id}')
-                await verification_table.delete(verification.discord_id)
+        for discord_id in await database.VerificationTable().delete_expired():
+            self.bot.logger.info(f'Cleaned up expired verification for {discord_id}')
 
     @verification_cleanup.before_loop
     async def before_verification_cleanup(self):
@@ -80,9 +77,11 @@ class User(commands.Cog):
             ephemeral=True
         )
 
-        # Cleanup after 2 minutes regardless of verification status
-        await asyncio.sleep(120)
-        await database.VerificationTable().delete(interaction.user.id)
+        # Cleanup once the verification expires regardless of verification status
+        self.bot.verification_expiry.schedule(
+            interaction.user.id,
+            datetime.now(timezone.utc) + OsuApi.verification_lifetime
+        )
 
     @user_group.command()
     async def remove(self, interaction: discord.Interaction):
@@ -120,18 +119,21 @@ class User(commands.Cog):
         user (discord.Member): User to view. If not provided, defaults to the author of the command
         """
 
+        # Defer since the osu! request can be retried for longer than Discord waits for a response
+        await interaction.response.defer()
+
         # Revert to author if no user provided
         if not user:
             user = interaction.user
 
         # Check if user is registered
         if not (db_user := await database.UserTable().get(user.id)):
-            return await interaction.response.send_message(
+            return await interaction.followup.send(
                 embed=embed_templates.error_warning('This user is not registered with the bot')
             )
 
         gamemode = Gamemode.from_id(db_user.gamemode)
-        osu_user = await OsuApi.get_user(db_user.osu_id, gamemode)
+        osu_user = await OsuApi.get_user(db_user.osu_id, gamemode, max_age=timedelta(minutes=5))
 
         # TODO add data validation
         # TODO show data when None
@@ -171,7 +173,7 @@ class User(commands.Cog):
         embed.add_field(name='Total Score', value=f'{osu_user["statistics"]["total_score"]:,}')
         embed.add_field(name='Ranked Score', value=f'{osu_user["statistics"]["ranked_score"]:,}')
         embed.add_field(name='Joined', value=joined_timestamp)
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     @user_group.command(name='gamemode')
     async def set_gamemode(self, interaction: discord.Interaction, gamemode: GamemodeOptions):
@@ -227,10 +229,14 @@ class User(commands.Cog):
 
         guild = await database.GuildTable().get(interaction.guild.id)
         if (user := await database.UserTable().get(interaction.user.id)):
-            osu_user = await OsuApi.get_user(user.osu_id, Gamemode.from_id(user.gamemode))
-            if osu_user:
-                update = await OsuApi.update_user_rank(guild, interaction.user, osu_user,
-                                                       Gamemode.from_id(user.gamemode),
+            gamemode = Gamemode.from_id(user.gamemode)
+
+            # Reuse the rank from the last fetch if it's recent, so repeated updates don't cost API requests
+            state = await database.RankStateTable().get(user.discord_id, gamemode.id)
+            max_age = timedelta(minutes=self.bot.rank_update.get('freshness_minutes', 60))
+
+            if (osu_user := await OsuApi.get_user_snapshot(user, gamemode, state, self.scheduler, max_age)):
+                update = await OsuApi.update_user_rank(guild, interaction.user, osu_user, gamemode,
                                                        reason='User forced rank update through command')
                 if update.get('success'):
                     return await interaction.followup.send(embed=embed_templates.success(update['message']))
@@ -0,0 +1,149 @@
+import asyncio
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from datetime import timedelta
+from time import monotonic
+from typing import Any
+
+
+class SnapshotStore:
+    """
+    Short-lived store for values fetched during a single run of something, like the rank update cycle.
+    Concurrent lookups of the same key share one fetch
+    """
+
+    def __init__(self):
+        self.entries: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the stored value for a key. Fetches and stores it if it's not stored yet
+
+        Parameters
+        ----------
+        key (Hashable): The key to look up
+        fetch (Callable[[], Awaitable[Any]]): Coroutine function that fetches the value on a miss
+
+        Returns
+        ----------
+        Any: The stored or fetched value
+        """
+
+        if (task := self.entries.get(key)):
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = self.entries[key] = asyncio.create_task(fetch())
+
+        try:
+            # Shielded so a cancelled caller doesn't cancel the fetch for everyone else waiting on it
+            return await asyncio.shield(task)
+        except Exception:
+            # Don't keep failures around. The next lookup gets to try again
+            if self.entries.get(key) is task:
+                del self.entries[key]
+            raise
+
+    def clear(self) -> None:
+        """
+        Removes all stored values and resets the counters
+        """
+
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class ResponseCache:
+    """
+    Bounded cache for API responses. Every lookup decides how old an entry it accepts,
+    and the least recently used entry is evicted once the cache is full.
+    Concurrent misses for the same key share one fetch
+    """
+
+    def __init__(self, max_size: int = 1024):
+        """
+        Parameters
+        ----------
+        max_size (int): Max amount of entries kept in the cache
+        """
+
+        self.max_size = max_size
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], max_age: timedelta | None = None) -> Any:
+        """
+        Returns the cached value for a key if it's recent enough. Fetches and caches it otherwise
+
+        Parameters
+        ----------
+        key (Hashable): The key to look up
+        fetch (Callable[[], Awaitable[Any]]): Coroutine function that fetches the value on a miss
+        max_age (timedelta): How old the cached value is allowed to be. Always fetches if None
+
+        Returns
+        ----------
+        Any: The cached or fetched value
+        """
+
+        if max_age is not None and (entry := self.entries.get(key)):
+            fetched_at, value = entry
+            if monotonic() - fetched_at <= max_age.total_seconds():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        if not (task := self.in_flight.get(key)):
+            task = self.in_flight[key] = asyncio.create_task(self.__fetch(key, fetch))
+
+        # Shielded so a cancelled caller doesn't cancel the fetch for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Caches a value. Evicts the least recently used entries if the cache is full
+
+        Parameters
+        ----------
+        key (Hashable): The key to cache the value under
+        value (Any): The value to cache
+        """
+
+        self.entries[key] = (monotonic(), value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def __fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Fetches a value and caches it. Empty results aren't cached
+
+        Parameters
+        ----------
+        key (Hashable): The key to cache the value under
+        fetch (Callable[[], Awaitable[Any]]): Coroutine function that fetches the value
+
+        Returns
+        ----------
+        Any: The fetched value
+        """
+
+        try:
+            value = await fetch()
+            if value is not None:
+                self.put(key, value)
+            return value
+        finally:
+            del self.in_flight[key]
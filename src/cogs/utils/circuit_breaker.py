@@ -0,0 +1,63 @@
+import asyncio
+from time import monotonic
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a service that keeps failing. Once enough requests in a row have failed,
+    everyone waiting on the breaker is held back until the service has had time to recover
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        Parameters
+        ----------
+        failure_threshold (int): Failures in a row before the breaker opens
+        reset_timeout (float): Seconds the breaker stays open before requests are let through again
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return monotonic() < self.opened_until
+
+    async def wait(self) -> None:
+        """
+        Waits until the breaker lets requests through
+        """
+
+        while (delay := self.opened_until - monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def open(self, seconds: float) -> None:
+        """
+        Holds back requests for a while, e.g. when the service has told us to back off.
+        Never shortens a pause that's already in place
+
+        Parameters
+        ----------
+        seconds (float): How long to hold back requests
+        """
+
+        self.opened_until = max(self.opened_until, monotonic() + seconds)
+
+    def record_success(self) -> None:
+        """
+        Closes the breaker again after a successful request
+        """
+
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        """
+        Counts a failed request and opens the breaker if there have been too many in a row.
+        While the failure count stays above the threshold, the first failed request after a pause opens it again
+        """
+
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.open(self.reset_timeout)
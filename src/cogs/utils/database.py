@@ -1,71 +1,101 @@
-from abc import abstractmethod
-from dataclasses import astuple, dataclass
-from datetime import datetime
+from collections.abc import AsyncIterator
+from dataclasses import astuple, dataclass, fields
+from datetime import datetime, timedelta, timezone
+from functools import cache
 
-import psycopg2
 import yaml
 
+from .metrics import timed_query
+from .storage import StorageEngine, create_engine
+
+with open('./src/config/config.yaml', 'r', encoding='utf8') as f:
+    db_config = yaml.load(f, Loader=yaml.SafeLoader).get('database', {})
+
+# Notification channel used by the verification server to tell the bot about new registrations
+USER_REGISTERED_CHANNEL = 'user_registered'
+
 
 class Database:
-    def __init__(self):
-        with open('./src/config/config.yaml', 'r', encoding='utf8') as f:
-            self.db = yaml.load(f, Loader=yaml.SafeLoader).get('database', {})
-
-        self.connection = psycopg2.connect(
-                host=self.db['host'],
-                dbname=self.db['dbname'],
-                user=self.db['username'],
-                password=self.db['password']
-            )
-        self.cursor = self.connection.cursor()
+    engine: StorageEngine | None = None
 
-    def init_db(self) -> None:
+    @staticmethod
+    async def open_engine() -> None:
         """
-        Creates all the necessary tables in order for the bot to function
+        Opens the storage engine shared by every table in the process
         """
 
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS public.guild (
-                discord_id bigint NOT NULL PRIMARY KEY,
-                whitelisted_countries char(2)[],
-                blacklisted_osu_users integer[],
-                role_remove bigint,
-                role_add bigint,
-                role_1_digit bigint,
-                role_2_digit bigint,
-                role_3_digit bigint,
-                role_4_digit bigint,
-                role_5_digit bigint,
-                role_6_digit bigint,
-                role_7_digit bigint,
-                role_standard bigint,
-                role_taiko bigint,
-                role_ctb bigint,
-                role_mania bigint
-            )
-            """
-        )
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS public.user (
-                discord_id bigint NOT NULL PRIMARY KEY,
-                osu_id integer NOT NULL,
-                gamemode smallint NOT NULL
-            )
-            """
-        )
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS public.verification (
-                discord_id bigint NOT NULL PRIMARY KEY,
-                uuid TEXT NOT NULL,
-                expires TIMESTAMP
-            )
-            """
-        )
+        if Database.engine:
+            return
+
+        engine = create_engine(db_config)
+        await engine.open()
+        Database.engine = engine
+
+    @staticmethod
+    async def close_engine() -> None:
+        """
+        Closes the shared storage engine
+        """
+
+        if Database.engine:
+            await Database.engine.close()
+            Database.engine = None
+
+    @staticmethod
+    async def get_engine() -> StorageEngine:
+        """
+        Returns the shared storage engine. Opens it if it hasn't been opened yet
 
-        self.connection.commit()
+        Returns
+        ----------
+        StorageEngine: The shared storage engine
+        """
+
+        if not Database.engine:
+            await Database.open_engine()
+        return Database.engine
+
+    @staticmethod
+    async def notify(channel: str, payload: str) -> None:
+        """
+        Sends a notification to everyone listening on a channel
+
+        Parameters
+        ----------
+        channel (str): The channel name
+        payload (str): The notification payload
+        """
+
+        engine = await Database.get_engine()
+        await engine.notify(channel, payload)
+
+    @staticmethod
+    async def listen(channel: str) -> AsyncIterator[str]:
+        """
+        Waits for notifications on a channel
+
+        Parameters
+        ----------
+        channel (str): The channel name
+
+        Returns
+        ----------
+        AsyncIterator[str]: The payloads of the notifications as they arrive
+        """
+
+        engine = await Database.get_engine()
+        async for payload in engine.listen(channel):
+            yield payload
+
+    async def init_db(self) -> None:
+        """
+        Creates all the necessary tables in order for the bot to function
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            for statement in engine.schema:
+                await connection.execute(statement)
 
     async def get_version(self) -> str:
         """
@@ -73,49 +103,129 @@ class Database:
 
         Returns
         ----------
-        str: The database driver name and its version number
+        str: The database name and its version number
         """
 
-        self.cursor.execute('SELECT VERSION()')
-        version = self.cursor.fetchone()[0].split(' ')[:2]
-        return ' '.join(version)
+        engine = await self.get_engine()
+        return await engine.version()
+
+
+@dataclass(frozen=True)
+class Statements:
+    """
+    Queries for the generic table methods, and the table's own queries by name.
+    Built once per table so every call sends the same text, which lets the database prepare them once per connection
+    """
+
+    get: str
+    get_all: str
+    count: str
+    create: str
+    save: str
+    save_many: str
+    delete: str
+    queries: dict[str, str]
+
+
+@cache
+def compile_statements(
+    table_name: str,
+    dataclass: type,
+    primary_key: tuple[str, ...],
+    queries: tuple[tuple[str, str], ...] = ()
+) -> Statements:
+    """
+    Builds the queries for a table from the fields of its dataclass
+
+    Parameters
+    ----------
+    table_name (str): The table name
+    dataclass (type): The dataclass rows are stored as. Its fields are the table's columns, in order
+    primary_key (tuple[str, ...]): The primary key columns
+    queries (tuple[tuple[str, str], ...]): The table's own queries as (name, query) pairs.
+                                           {table}, {columns} and {placeholders} are filled in
+
+    Returns
+    ----------
+    Statements: The queries
+    """
+
+    columns = [field.name for field in fields(dataclass)]
+    column_list = ', '.join(columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    table = f'public.{table_name}'
+
+    key_list = ', '.join(primary_key)
+    key_placeholders = ', '.join(['%s'] * len(primary_key))
+    key_match = ' AND '.join(f'{column} = %s' for column in primary_key)
+
+    updated_columns = [column for column in columns if column not in primary_key] or primary_key
+    upsert = (
+        f'INSERT INTO {table} ({column_list}) VALUES ({placeholders}) '
+        f'ON CONFLICT ({key_list}) DO UPDATE SET '
+        + ', '.join(f'{column} = EXCLUDED.{column}' for column in updated_columns)
+    )
+
+    return Statements(
+        get=f'SELECT {column_list} FROM {table} WHERE {key_match}',
+        get_all=f'SELECT {column_list} FROM {table}',
+        count=f'SELECT COUNT(*) FROM {table}',
+        # Updating the row to itself on conflict makes it come back from RETURNING even if someone else created it
+        create=f'INSERT INTO {table} ({key_list}) VALUES ({key_placeholders}) ON CONFLICT ({key_list}) ' +
+               f'DO UPDATE SET {primary_key[0]} = EXCLUDED.{primary_key[0]} RETURNING {column_list}',
+        save=f'{upsert} RETURNING {column_list}',
+        save_many=upsert,
+        delete=f'DELETE FROM {table} WHERE {key_match}',
+        queries={
+            name: query.format(table=table, columns=column_list, placeholders=placeholders)
+            for name, query in queries
+        }
+    )
 
 
 class Table(Database):
+    primary_key: tuple[str, ...] = ('discord_id',)
+
+    # The table's own queries by name, compiled along with the generic ones
+    queries: dict[str, str] = {}
+
     def __init__(self, table_name: str, dataclass: dataclass, create_row_on_none: bool = False):
-        super().__init__()
         self.table_name = table_name
         self.dataclass = dataclass
         self.create_row_on_none = create_row_on_none
+        self.statements = compile_statements(
+            table_name, dataclass, self.primary_key, tuple(self.queries.items())
+        )
 
-    async def get(self, discord_id: int) -> dataclass:
+    @timed_query
+    async def get(self, *key: int) -> dataclass:
         """
         Fetches a row from the database
 
         Parameters
         ----------
-        discord_id (int): The Discord ID
+        key (int): The primary key, one value per key column. Just the Discord ID for most tables
 
         Returns
         ----------
         dataclass: A dataclass object
         """
 
-        self.cursor.execute(f'SELECT * FROM public.{self.table_name} WHERE discord_id = %s', (discord_id,))
-        db_data = self.cursor.fetchone()
-
-        if not db_data:
-            if not self.create_row_on_none:
-                return None
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.get, key, prepare=True)
+            db_data = await cursor.fetchone()
 
-            self.cursor.execute(f'INSERT INTO public.{self.table_name} VALUES (%s)', (discord_id,))
-            self.connection.commit()
+            if not db_data:
+                if not self.create_row_on_none:
+                    return None
 
-            self.cursor.execute(f'SELECT * FROM public.{self.table_name} WHERE discord_id = %s', (discord_id,))
-            db_data = self.cursor.fetchone()
+                cursor = await connection.execute(self.statements.create, key, prepare=True)
+                db_data = await cursor.fetchone()
 
         return self.dataclass(*db_data)
 
+    @timed_query
     async def get_all(self) -> tuple[dataclass]:
         """
         Fetches all the rows from the database
@@ -125,11 +235,14 @@ class Table(Database):
         tuple[dataclass]: A tuple of dataclass objects
         """
 
-        self.cursor.execute(f'SELECT * FROM public.{self.table_name}')
-        db_data = self.cursor.fetchall()
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.get_all, prepare=True)
+            db_data = await cursor.fetchall()
 
         return tuple(self.dataclass(*data) for data in db_data)
 
+    @timed_query
     async def count(self) -> int:
         """
         Counts the number of rows in the database
@@ -138,36 +251,63 @@ class Table(Database):
         int: The number of rows in the database
         """
 
-        self.cursor.execute(f'SELECT COUNT(*) FROM public.{self.table_name}')
-        return self.cursor.fetchone()[0]
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.count, prepare=True)
+            return (await cursor.fetchone())[0]
 
-    @abstractmethod
-    async def save(self, data: dataclass) -> None:
+    @timed_query
+    async def save(self, data: dataclass) -> dataclass:
         """
-        Saves a row to the database
+        Saves a row to the database. Inserts it, or updates the row with the same primary key
 
         Parameters
         ----------
         data (dataclass): A dataclass object
-        Raises
+
+        Returns
         ----------
-        NotImplementedError: If the child class does not implement this method
+        dataclass: The row as it was stored
         """
 
-        # Leave implementation to the child class
-        raise NotImplementedError()
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.save, astuple(data), prepare=True)
+            db_data = await cursor.fetchone()
+
+        return self.dataclass(*db_data)
 
-    async def delete(self, discord_id: int) -> None:
+    @timed_query
+    async def save_many(self, rows: list[dataclass]) -> None:
+        """
+        Saves multiple rows to the database in a single transaction
+
+        Parameters
+        ----------
+        rows (list[dataclass]): Dataclass objects
+        """
+
+        if not rows:
+            return
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.executemany(self.statements.save_many, [astuple(row) for row in rows])
+
+    @timed_query
+    async def delete(self, *key: int) -> None:
         """
         Deletes a row from the database
 
         Parameters
         ----------
-        discord_id (int): The Discord ID
+        key (int): The primary key, one value per key column. Just the Discord ID for most tables
         """
 
-        self.cursor.execute(f'DELETE FROM public.{self.table_name} WHERE discord_id = %s', (discord_id,))
-        self.connection.commit()
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            await connection.execute(self.statements.delete, key, prepare=True)
 
 
 @dataclass
@@ -194,98 +334,289 @@ class GuildTable(Table):
     def __init__(self):
         super().__init__(table_name='guild', dataclass=Guild, create_row_on_none=True)
 
-    async def save(self, guild: Guild) -> None:
+
+@dataclass
+class User:
+    discord_id: int
+    osu_id: int
+    gamemode: int
+
+
+class UserTable(Table):
+    queries = {
+        'get_many': 'SELECT {columns} FROM {table} WHERE discord_id = ANY(%s)'
+    }
+
+    def __init__(self):
+        super().__init__(table_name='user', dataclass=User, create_row_on_none=False)
+
+    @timed_query
+    async def get_many(self, discord_ids: list[int]) -> dict[int, User]:
         """
-        Save a guild object in the database
+        Fetches multiple users from the database in a single query
 
         Parameters
         ----------
-        guild (Guild): A guild object
+        discord_ids (list[int]): The Discord IDs to look up
+
+        Returns
+        ----------
+        dict[int, User]: Users keyed by Discord ID. IDs that aren't registered are left out
         """
 
-        values = astuple(guild)
+        if not discord_ids:
+            return {}
 
-        try:
-            self.cursor.execute(
-                f"""
-                INSERT INTO {self.table_name}
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, values)
-            self.connection.commit()
-        except psycopg2.errors.UniqueViolation:
-            self.connection.rollback()
-        else:
-            return
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.queries['get_many'], (list(discord_ids),), prepare=True)
+            db_data = await cursor.fetchall()
 
-        values = values + (guild.discord_id,)
-
-        self.cursor.execute(
-            f"""
-            UPDATE {self.table_name} SET
-            discord_id = %s,
-            whitelisted_countries = %s,
-            blacklisted_osu_users = %s,
-            role_remove = %s,
-            role_add = %s,
-            role_1_digit = %s,
-            role_2_digit = %s,
-            role_3_digit = %s,
-            role_4_digit = %s,
-            role_5_digit = %s,
-            role_6_digit = %s,
-            role_7_digit = %s,
-            role_standard = %s,
-            role_taiko = %s,
-            role_ctb = %s,
-            role_mania = %s
-            WHERE discord_id = %s
-            """, values
-        )
-        self.connection.commit()
+        users = (self.dataclass(*data) for data in db_data)
+        return {user.discord_id: user for user in users}
 
 
 @dataclass
-class User:
+class RankState:
     discord_id: int
-    osu_id: int
     gamemode: int
+    osu_id: int
+    country_code: str
+    last_rank: int | None
+    last_pp: float | None
+    last_fetched_at: datetime
+    rank_velocity: float | None
+    next_check_at: datetime
+
+    def is_due(self) -> bool:
+        """
+        Checks if the user's rank is scheduled to be checked again
 
+        Returns
+        ----------
+        bool: True if the scheduled next check has passed
+        """
+
+        return datetime.now(timezone.utc).replace(tzinfo=None) >= self.next_check_at
+
+    def is_fresh(self, max_age: timedelta) -> bool:
+        """
+        Checks if the state was fetched recently enough to be trusted
+
+        Parameters
+        ----------
+        max_age (timedelta): How old the state is allowed to be
+
+        Returns
+        ----------
+        bool: True if the state is younger than max_age
+        """
+
+        return datetime.now(timezone.utc).replace(tzinfo=None) - self.last_fetched_at < max_age
+
+
+class RankStateTable(Table):
+    """
+    The rank each user had in each gamemode the last time it was fetched.
+    Keyed by (discord_id, gamemode), so get and delete take both
+    """
+
+    primary_key = ('discord_id', 'gamemode')
+    queries = {
+        'get_many': 'SELECT {columns} FROM {table} WHERE discord_id = ANY(%s)',
+        'get_due': """
+            SELECT s.discord_id FROM {table} s
+            JOIN public.user u ON u.discord_id = s.discord_id AND u.gamemode = s.gamemode
+            WHERE s.next_check_at <= %s
+            """
+    }
 
-class UserTable(Table):
     def __init__(self):
-        super().__init__(table_name='user', dataclass=User, create_row_on_none=False)
+        super().__init__(table_name='user_rank_state', dataclass=RankState, create_row_on_none=False)
 
-    async def save(self, user: User) -> None:
+    @timed_query
+    async def get_many(self, discord_ids: list[int]) -> dict[tuple[int, int], RankState]:
         """
-        Save a user object in the database
+        Fetches the rank states of multiple users in a single query
 
         Parameters
         ----------
-        user (User): A user object
+        discord_ids (list[int]): The Discord IDs to look up
+
+        Returns
+        ----------
+        dict[tuple[int, int], RankState]: Rank states keyed by (discord_id, gamemode)
+        """
+
+        if not discord_ids:
+            return {}
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.queries['get_many'], (list(discord_ids),), prepare=True)
+            db_data = await cursor.fetchall()
+
+        states = (self.dataclass(*data) for data in db_data)
+        return {(state.discord_id, state.gamemode): state for state in states}
+
+    @timed_query
+    async def get_due(self) -> set[int]:
         """
+        Fetches the users whose rank is due to be checked in their current gamemode.
+        Users that have never been checked aren't included
 
-        values = astuple(user)
+        Returns
+        ----------
+        set[int]: The Discord IDs of the users that are due
+        """
 
-        try:
-            self.cursor.execute(f'INSERT INTO public.{self.table_name} VALUES (%s, %s, %s)', values)
-            self.connection.commit()
-        except psycopg2.errors.UniqueViolation:
-            self.connection.rollback()
-        else:
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(
+                self.statements.queries['get_due'], (datetime.now(timezone.utc).replace(tzinfo=None),), prepare=True
+            )
+            db_data = await cursor.fetchall()
+
+        return {data[0] for data in db_data}
+
+
+@dataclass
+class UpdateJob:
+    guild_id: int
+    discord_id: int
+    leased_by: str | None
+    lease_expires: datetime | None
+    attempts: int
+
+
+class UpdateJobTable(Table):
+    """
+    Work queue for rank updates, shared by every bot process connected to the database.
+    Jobs are leased to one process at a time. If a process dies its leases expire and other processes take over.
+    Keyed by (guild_id, discord_id), so get and delete take both
+    """
+
+    primary_key = ('guild_id', 'discord_id')
+    queries = {
+        'enqueue': 'INSERT INTO {table} (guild_id, discord_id) VALUES (%s, %s) ON CONFLICT DO NOTHING',
+        'claim': """
+            UPDATE {table} SET
+            leased_by = %s,
+            lease_expires = now() + %s,
+            attempts = attempts + 1
+            WHERE (guild_id, discord_id) IN (
+                SELECT guild_id, discord_id FROM {table}
+                WHERE guild_id = ANY(%s) AND (lease_expires IS NULL OR lease_expires < now())
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {columns}
+            """,
+        'heartbeat': 'UPDATE {table} SET lease_expires = now() + %s WHERE leased_by = %s',
+        'complete': 'DELETE FROM {table} WHERE guild_id = %s AND discord_id = %s AND leased_by = %s',
+        'release': """
+            UPDATE {table} SET
+            leased_by = NULL,
+            lease_expires = now() + %s
+            WHERE guild_id = %s AND discord_id = %s AND leased_by = %s
+            """
+    }
+
+    def __init__(self):
+        super().__init__(table_name='update_job', dataclass=UpdateJob, create_row_on_none=False)
+
+    @timed_query
+    async def enqueue(self, jobs: list[tuple[int, int]]) -> None:
+        """
+        Adds jobs to the queue. Jobs that are already queued are left alone
+
+        Parameters
+        ----------
+        jobs (list[tuple[int, int]]): (guild_id, discord_id) pairs
+        """
+
+        if not jobs:
             return
 
-        values = astuple(user) + (user.discord_id,)
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.executemany(self.statements.queries['enqueue'], jobs)
 
-        self.cursor.execute(
-            f"""
-            UPDATE public.{self.table_name} SET
-            discord_id = %s,
-            osu_id = %s,
-            gamemode = %s
-            WHERE discord_id = %s
-            """, values
-        )
-        self.connection.commit()
+    @timed_query
+    async def claim(self, worker_id: str, guild_ids: list[int], limit: int, lease: timedelta) -> list[UpdateJob]:
+        """
+        Leases jobs that aren't leased by anyone else, or whose lease has expired.
+        Rows locked by other processes are skipped instead of waited on
+
+        Parameters
+        ----------
+        worker_id (str): Identifies the process taking the lease
+        guild_ids (list[int]): Only claim jobs for these guilds
+        limit (int): Max amount of jobs to claim
+        lease (timedelta): How long the lease lasts unless it's renewed
+
+        Returns
+        ----------
+        list[UpdateJob]: The claimed jobs. Empty if there's nothing left to claim
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(
+                self.statements.queries['claim'], (worker_id, lease, list(guild_ids), limit), prepare=True
+            )
+            db_data = await cursor.fetchall()
+
+        return [self.dataclass(*data) for data in db_data]
+
+    @timed_query
+    async def heartbeat(self, worker_id: str, lease: timedelta) -> None:
+        """
+        Renews all leases held by a process
+
+        Parameters
+        ----------
+        worker_id (str): Identifies the process holding the leases
+        lease (timedelta): How long the renewed leases last
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            await connection.execute(self.statements.queries['heartbeat'], (lease, worker_id), prepare=True)
+
+    @timed_query
+    async def complete(self, job: UpdateJob) -> None:
+        """
+        Removes a finished job from the queue. Does nothing if the lease has been taken over by another process
+
+        Parameters
+        ----------
+        job (UpdateJob): The finished job
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            await connection.execute(
+                self.statements.queries['complete'], (job.guild_id, job.discord_id, job.leased_by), prepare=True
+            )
+
+    @timed_query
+    async def release(self, job: UpdateJob, delay: timedelta) -> None:
+        """
+        Gives up the lease on a job so it can be retried later
+
+        Parameters
+        ----------
+        job (UpdateJob): The job to release
+        delay (timedelta): How long to wait before the job can be claimed again
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            await connection.execute(
+                self.statements.queries['release'], (delay, job.guild_id, job.discord_id, job.leased_by), prepare=True
+            )
 
 
 @dataclass
@@ -296,9 +627,16 @@ class Verification:
 
 
 class VerificationTable(Table):
+    queries = {
+        'insert': 'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+        'get_pending': 'SELECT {columns} FROM {table} WHERE discord_id = %s AND expires >= now()',
+        'delete_expired': 'DELETE FROM {table} WHERE expires < now() RETURNING discord_id'
+    }
+
     def __init__(self):
         super().__init__(table_name='verification', dataclass=Verification, create_row_on_none=False)
 
+    @timed_query
     async def insert(self, verification: Verification) -> bool:
         """
         Insert a new pending verification into the database
@@ -314,11 +652,50 @@ class VerificationTable(Table):
 
         values = astuple(verification)
 
-        try:
-            self.cursor.execute(f'INSERT INTO {self.table_name} VALUES (%s, %s, %s)', values)
-            self.connection.commit()
-        except psycopg2.errors.UniqueViolation:
-            self.connection.rollback()
-            return False
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            try:
+                await connection.execute(self.statements.queries['insert'], values, prepare=True)
+            except engine.unique_violation:
+                await connection.rollback()
+                return False
 
         return True
+
+    @timed_query
+    async def get_pending(self, discord_id: int) -> Verification | None:
+        """
+        Fetches a pending verification that hasn't expired yet
+
+        Parameters
+        ----------
+        discord_id (int): The Discord ID
+
+        Returns
+        ----------
+        Verification: A verification object. None if there's no pending verification or it has expired
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.queries['get_pending'], (discord_id,), prepare=True)
+            db_data = await cursor.fetchone()
+
+        return self.dataclass(*db_data) if db_data else None
+
+    @timed_query
+    async def delete_expired(self) -> list[int]:
+        """
+        Deletes all expired verifications in a single query
+
+        Returns
+        ----------
+        list[int]: The Discord IDs of the deleted verifications
+        """
+
+        engine = await self.get_engine()
+        async with engine.connection() as connection:
+            cursor = await connection.execute(self.statements.queries['delete_expired'], prepare=True)
+            db_data = await cursor.fetchall()
+
+        return [data[0] for data in db_data]
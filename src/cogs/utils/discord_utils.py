@@ -18,3 +18,33 @@ def get_color(discord_object: discord.User | discord.Member | discord.Role) -> d
         return discord_object.color
 
     return discord.Colour(0x99AAB5)
+
+
+def diff_roles(
+    member: discord.Member,
+    roles_to_add: list[discord.Role | None],
+    roles_to_remove: list[discord.Role | None]
+) -> list[discord.Role] | None:
+    """
+    Works out the member's complete role list after adding and removing the given roles
+
+    Parameters
+    -----------
+    member (discord.Member): The member whose roles are changing
+    roles_to_add (list[discord.Role|None]): Roles the member should have. None values are ignored
+    roles_to_remove (list[discord.Role|None]): Roles the member should not have. None values are ignored
+
+    Returns
+    -----------
+    (list[discord.Role]|None): The member's new roles. None if the member already has the correct roles
+    """
+
+    current_roles = set(member.roles)
+    new_roles = (current_roles - set(roles_to_remove)) | set(roles_to_add)
+    new_roles.discard(None)
+
+    if new_roles == current_roles:
+        return None
+
+    # The @everyone role is implicit and can't be part of an edit
+    return [role for role in new_roles if not role.is_default()]
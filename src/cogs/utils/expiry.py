@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from datetime import datetime, timezone
+
+
+class ExpiryScheduler:
+    """
+    Runs a callback for every key once its expiry time has passed.
+    Keys are kept in a min-heap, so a single task only ever has to sleep until the earliest expiry
+    """
+
+    def __init__(self, callback: Callable[[Hashable], Awaitable[None]]):
+        """
+        Parameters
+        ----------
+        callback (Callable[[Hashable], Awaitable[None]]): Coroutine function called with each expired key
+        """
+
+        self.callback = callback
+        self.heap: list[tuple[datetime, int, Hashable]] = []
+        self.expiries: dict[Hashable, datetime] = {}
+        self.counter = itertools.count()  # Tie breaker so keys themselves never have to be compared
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.expiries)
+
+    def schedule(self, key: Hashable, expires: datetime) -> None:
+        """
+        Schedules a key to expire. Replaces the key's previous expiry if it already has one
+
+        Parameters
+        ----------
+        key (Hashable): The key to expire
+        expires (datetime): When the key expires. Must be timezone aware
+        """
+
+        self.expiries[key] = expires
+        heapq.heappush(self.heap, (expires, next(self.counter), key))
+
+        # Wake the runner up if this is the new earliest expiry
+        if self.heap[0][2] == key:
+            self.wakeup.set()
+
+    def cancel(self, key: Hashable) -> None:
+        """
+        Cancels a key's expiry. Does nothing if the key isn't scheduled
+
+        Parameters
+        ----------
+        key (Hashable): The key to cancel
+        """
+
+        # The heap entry is left behind and skipped once it comes up
+        self.expiries.pop(key, None)
+
+    def start(self) -> None:
+        """
+        Starts expiring keys in the background
+        """
+
+        if not self.task:
+            self.task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        """
+        Stops expiring keys. Scheduled keys are kept
+        """
+
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def __run(self) -> None:
+        """
+        Sleeps until the earliest expiry and runs the callback for every key that has expired
+        """
+
+        while True:
+            self.wakeup.clear()
+
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+
+            expires, _, key = self.heap[0]
+            delay = (expires - datetime.now(timezone.utc)).total_seconds()
+            if delay > 0:
+                # Sleep until the expiry, unless an earlier one is scheduled in the meantime
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+
+            # Skip entries that have been cancelled or replaced by a later expiry
+            if self.expiries.get(key) != expires:
+                continue
+            del self.expiries[key]
+
+            try:
+                await self.callback(key)
+            except Exception:
+                logging.getLogger('discord').exception(f'Failed to expire {key}')
@@ -0,0 +1,108 @@
+import asyncio
+import functools
+from collections.abc import Awaitable, Callable
+from time import perf_counter
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import REGISTRY, Collector
+
+# Rank update cycle
+CYCLE_DURATION = Histogram(
+    'rank_update_cycle_seconds', 'Time spent on one run of the rank update cycle',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+CYCLE_USERS = Counter(
+    'rank_update_users_total', 'Members handled by the rank update cycle', ['result']  # processed, skipped, failed
+)
+CYCLE_SNAPSHOTS = Counter(
+    'rank_update_snapshot_lookups_total', 'osu! user lookups during the rank update cycle', ['result']  # hit, miss
+)
+
+# osu! API
+OSU_REQUEST_LATENCY = Histogram('osu_api_request_seconds', 'Latency of requests to the osu! API')
+OSU_RESPONSES = Counter('osu_api_responses_total', 'Responses from the osu! API', ['status'])
+
+# Discord
+ROLE_EDITS = Counter('discord_role_edits_total', 'Member role edits sent to Discord', ['result'])  # success, failed
+
+# Database
+DB_QUERY_LATENCY = Histogram(
+    'db_query_seconds', 'Latency of database table methods', ['table', 'method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# Event loop
+EVENT_LOOP_LAG = Gauge('event_loop_lag_seconds', 'How late the event loop was to wake up a sleeping task')
+
+
+def timed_query(method: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Decorator that records the latency of a database table method
+
+    Parameters
+    ----------
+    method (Callable[..., Awaitable]): A coroutine method of a Table
+
+    Returns
+    ----------
+    Callable[..., Awaitable]: The wrapped method
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            DB_QUERY_LATENCY.labels(self.table_name, method.__name__).observe(perf_counter() - start)
+
+    return wrapper
+
+
+async def monitor_event_loop_lag(interval: float = 1) -> None:
+    """
+    Measures how late the event loop is to wake up a sleeping task, until cancelled.
+    Lag means something is blocking the loop or it has more work than it can keep up with
+
+    Parameters
+    ----------
+    interval (float): Seconds between measurements
+    """
+
+    while True:
+        start = perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, perf_counter() - start - interval))
+
+
+class CacheCollector(Collector):
+    """Exposes the counters of a cache that keeps its own hits, misses and evictions"""
+
+    def __init__(self, name: str, cache: object):
+        """
+        Parameters
+        ----------
+        name (str): Metric name prefix
+        cache (object): The cache. Needs hits, misses and evictions attributes
+        """
+
+        self.name = name
+        self.cache = cache
+
+    def collect(self):
+        for counter in ('hits', 'misses', 'evictions'):
+            yield CounterMetricFamily(f'{self.name}_{counter}', f'Cache {counter}', value=getattr(self.cache, counter))
+
+
+def register_cache(name: str, cache: object) -> None:
+    """
+    Exposes a cache's counters on the metrics endpoint
+
+    Parameters
+    ----------
+    name (str): Metric name prefix
+    cache (object): The cache. Needs hits, misses and evictions attributes
+    """
+
+    REGISTRY.register(CacheCollector(name, cache))
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import asyncio
+import dataclasses
+import random
 import uuid
 from codecs import open
+from time import perf_counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from enum import Enum
@@ -9,17 +13,51 @@ from enum import Enum
 import aiohttp
 import discord
 import yaml
-from expiringdict import ExpiringDict
 
-from . import database
+from . import database, discord_utils, metrics
+from .cache import ResponseCache
+from .circuit_breaker import CircuitBreaker
+from .rate_limiter import TokenBucket
+from .role_dispatcher import RoleEditDispatcher
+from .scheduling import UpdateScheduler
+from .token_manager import TokenManager
+
+
+class OsuApiError(Exception):
+    """Raised when a request to the osu! API fails"""
+
+    def __init__(self, status: int | None, message: str):
+        """
+        Parameters
+        ----------
+        status (int): The response status. None if no response was received
+        message (str): What went wrong
+        """
+
+        super().__init__(message)
+        self.status = status
 
 
 class OsuApi:
-    cache = ExpiringDict(max_len=1, max_age_seconds=86400)
+    tokens = TokenManager(lambda: OsuApi.renew_token())
+    session: aiohttp.ClientSession | None = None
+    verification_lifetime = timedelta(minutes=2)  # How long users have to complete a verification
 
     with open('./src/config/config.yaml', 'r', encoding='utf8') as f:
         credntials = yaml.load(f, Loader=yaml.SafeLoader).get('api', {}).get('osu', {})
 
+    base_url = credntials.get('base_url', 'https://osu.ppy.sh')  # Can be pointed at a stand-in for benchmarks
+    user_cache = ResponseCache(max_size=credntials.get('cache_size', 1024))
+
+    # Retries and circuit breaker for requests to osu!
+    max_retries = credntials.get('max_retries', 3)
+    backoff_base = 0.5
+    backoff_cap = 30
+    breaker = CircuitBreaker(
+        failure_threshold=credntials.get('breaker_threshold', 5),
+        reset_timeout=credntials.get('breaker_timeout', 30)
+    )
+
     base_payload = {
         'client_id': credntials.get('client_id'),
         'client_secret': credntials.get('client_secret')
@@ -39,26 +77,183 @@ class OsuApi:
     })
 
     @classmethod
-    async def renew_token(cls) -> None:
+    async def open_session(cls) -> None:
+        """
+        Opens the HTTP session shared by all requests to osu!. Connections are kept alive and reused between requests
+        """
+
+        if cls.session and not cls.session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=cls.credntials.get('connection_limit', 20),
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        cls.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+
+    @classmethod
+    async def close_session(cls) -> None:
+        """
+        Closes the shared HTTP session
+        """
+
+        if cls.session:
+            await cls.session.close()
+            cls.session = None
+
+    @classmethod
+    async def get_session(cls) -> aiohttp.ClientSession:
+        """
+        Returns the shared HTTP session. Opens it if it hasn't been opened yet
+
+        Returns
+        ----------
+        aiohttp.ClientSession: The shared HTTP session
+        """
+
+        if not cls.session or cls.session.closed:
+            await cls.open_session()
+        return cls.session
+
+    @classmethod
+    async def renew_token(cls) -> tuple[str, int]:
         """
         Requests a new Authorization Code from the osu!api v2
+
+        Returns
+        ----------
+        tuple[str, int]: The access token and how many seconds it's valid for
+
+        Raises
+        ----------
+        OsuApiError: If osu! doesn't hand out a token
         """
 
         print('Fetching new token...')
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://osu.ppy.sh/oauth/token', json=cls.token_payload) as r:
-                if r.status == 200:
-                    data = await r.json()
+        session = await cls.get_session()
+        async with session.post(f'{cls.base_url}/oauth/token', json=cls.token_payload) as r:
+            if r.status == 200:
+                data = await r.json()
+                return data.get('access_token'), data.get('expires_in', 86400)
+            else:
+                raise OsuApiError(r.status, f'Failed to renew token - {r.reason}')
 
-                    cls.cache.update({
-                        'token': data.get('access_token')
-                    })
+    @classmethod
+    async def __get(cls, url: str, limiter: TokenBucket | None = None) -> dict | None:
+        """
+        Sends a GET request to the osu!api v2. Failed requests are retried with jittered exponential backoff,
+        and everyone holds back while the circuit breaker is open or osu! has asked us to slow down
+
+        Parameters
+        ----------
+        url (str): The endpoint URL
+        limiter (TokenBucket): Optional rate limiter to wait on before every request, retries included
+
+        Returns
+        ----------
+        dict: The response data. None if osu! responded with 404
+
+        Raises
+        ----------
+        OsuApiError: If the request still fails after retrying, or osu! rejected it outright
+        """
+
+        for attempt in range(cls.max_retries + 1):
+            await cls.breaker.wait()
+
+            delay = cls.__backoff(attempt)
+            try:
+                status, data, retry_after = await cls.__send(url, limiter)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.OSU_RESPONSES.labels('error').inc()
+                cls.breaker.record_failure()
+                error = OsuApiError(None, f'Request failed - {e!r}')
+            else:
+                if status in (200, 404):
+                    cls.breaker.record_success()
+                    return data
+
+                error = OsuApiError(status, f'Request failed with status {status}')
+                if status == 429:
+                    # Pause every request, not just this one, until osu! is ready for us again
+                    cls.breaker.open(retry_after or delay)
+                    delay = 0
+                elif status >= 500:
+                    cls.breaker.record_failure()
                 else:
-                    raise aiohttp.HTTPException(response=r.status, message=r.reason)
+                    raise error
+
+            if attempt < cls.max_retries:
+                await asyncio.sleep(delay)
+
+        raise error
 
     @classmethod
-    async def get_user(cls, user: str, gamemode: Gamemode) -> dict | None:
+    async def __send(cls, url: str, limiter: TokenBucket | None = None) -> tuple[int, dict | None, float | None]:
+        """
+        Sends a single authorized GET request to the osu!api v2.
+        A rejected token is renewed once and the request replayed
+
+        Parameters
+        ----------
+        url (str): The endpoint URL
+        limiter (TokenBucket): Optional rate limiter to wait on before the request and its replay
+
+        Returns
+        ----------
+        tuple[int, dict, float]: The response status, its data and the Retry-After header in seconds.
+                                 Data is None unless the request succeeded
+        """
+
+        session = await cls.get_session()
+        token = await cls.tokens.get()
+
+        for attempt in range(2):
+            if limiter:
+                await limiter.acquire()
+
+            header = {'Authorization': f'Bearer {token}'}
+            start = perf_counter()
+            async with session.get(url, headers=header) as r:
+                metrics.OSU_REQUEST_LATENCY.observe(perf_counter() - start)
+                metrics.OSU_RESPONSES.labels(str(r.status)).inc()
+
+                if r.status == 401 and not attempt:
+                    token = await cls.tokens.invalidate(token)
+                    continue
+
+                retry_after = r.headers.get('Retry-After')
+                retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+                if r.status == 200:
+                    return r.status, await r.json(), retry_after
+                return r.status, None, retry_after
+
+    @classmethod
+    def __backoff(cls, attempt: int) -> float:
+        """
+        Works out how long to wait before retrying a failed request. Jittered so retries don't all land at once
+
+        Parameters
+        ----------
+        attempt (int): How many times the request has been tried before
+
+        Returns
+        ----------
+        float: Seconds to wait
+        """
+
+        return random.uniform(0, min(cls.backoff_cap, cls.backoff_base * 2 ** attempt))
+
+    @classmethod
+    async def get_user(
+        cls,
+        user: str,
+        gamemode: Gamemode,
+        max_age: timedelta | None = None,
+        limiter: TokenBucket | None = None
+    ) -> dict | None:
         """
         Fetch osu! user info from the v2 API
 
@@ -66,25 +261,68 @@ class OsuApi:
         ----------
         user (str): The osu username or user id
         gamemode (Gamemode): Specified gamemode for statistics
+        max_age (timedelta): How old a cached response is allowed to be. Always fetches if None
+        limiter (TokenBucket): Optional rate limiter to wait on before every request to osu!
 
         Returns
         ----------
         dict: The user data. None if user not found
+
+        Raises
+        ----------
+        OsuApiError: If osu! couldn't be reached
         """
 
-        # Get cached API token. Renew token if expired
-        token = cls.cache.get('token')
-        if not token:
-            await cls.renew_token()
-            token = cls.cache.get('token')
+        async def fetch() -> dict | None:
+            return await cls.__get(f'{cls.base_url}/api/v2/users/{user}/{gamemode.url_name}', limiter)
 
-        # Get user data
-        async with aiohttp.ClientSession() as session:
-            header = {'Authorization': f'Bearer {token}'}
-            async with session.get(f'https://osu.ppy.sh/api/v2/users/{user}/{gamemode.url_name}', headers=header) as r:
-                if r.status == 200:
-                    data = await r.json()
-                    return data
+        return await cls.user_cache.get((str(user).lower(), gamemode.id), fetch, max_age)
+
+    @classmethod
+    async def get_user_snapshot(
+        cls,
+        user: database.User,
+        gamemode: Gamemode,
+        state: database.RankState | None,
+        scheduler: UpdateScheduler,
+        max_age: timedelta | None = None,
+        limiter: TokenBucket | None = None
+    ) -> OsuUserSnapshot | None:
+        """
+        Get the parts of a registered user's osu! profile needed for rank updates.
+        Uses the stored rank state until it's due for a new check, otherwise fetches the user and stores the new state
+
+        Parameters
+        ----------
+        user (database.User): The registered user
+        gamemode (Gamemode): Specified gamemode for statistics
+        state (database.RankState): The user's stored rank state for the gamemode, if any
+        scheduler (UpdateScheduler): Decides when the user should be checked again after a fetch
+        max_age (timedelta): How old the stored rank state is allowed to be. Uses the state's scheduled check if None
+        limiter (TokenBucket): Optional rate limiter to wait on before every request to osu!
+
+        Returns
+        ----------
+        OsuUserSnapshot: The user's snapshot. None if user not found
+        """
+
+        if state and state.osu_id == user.osu_id:
+            if (state.is_fresh(max_age) if max_age else not state.is_due()):
+                return OsuUserSnapshot.from_rank_state(state)
+
+        if not (osu_user := await cls.get_user(user.osu_id, gamemode, limiter=limiter)):
+            # Deleted or restricted. Put off the next check as long as possible, or the user stays due forever
+            if state:
+                next_check_at = datetime.now(timezone.utc).replace(tzinfo=None) + scheduler.max_interval
+                await database.RankStateTable().save(dataclasses.replace(state, next_check_at=next_check_at))
+            return None
+
+        # A previous state for another osu! account says nothing about how this one moves
+        previous = state if state and state.osu_id == user.osu_id else None
+
+        snapshot = OsuUserSnapshot.from_api(osu_user)
+        await database.RankStateTable().save(snapshot.to_rank_state(user.discord_id, gamemode, previous, scheduler))
+        return snapshot
 
     @classmethod
     async def get_me_user(cls, code: str, gamemode: Gamemode) -> dict:
@@ -102,27 +340,27 @@ class OsuApi:
         """
 
         # Use code to get token
-        async with aiohttp.ClientSession() as session:
-            payload = cls.user_payload.copy()
-            payload.update({
-                'code': code
-            })
-
-            async with session.post('https://osu.ppy.sh/oauth/token', json=payload) as r:
-                if r.status == 200:
-                    data = await r.json()
-                    token = data.get('access_token')
-                else:
-                    raise aiohttp.ClientResponseError(r.request_info, r.history)
-
-            # Get user data
-            header = {'Authorization': f'Bearer {token}'}
-            async with session.get(f'https://osu.ppy.sh/api/v2/me/{gamemode.url_name}', headers=header) as r:
-                if r.status == 200:
-                    data = await r.json()
-                    return data
+        session = await cls.get_session()
+        payload = cls.user_payload.copy()
+        payload.update({
+            'code': code
+        })
+
+        async with session.post(f'{cls.base_url}/oauth/token', json=payload) as r:
+            if r.status == 200:
+                data = await r.json()
+                token = data.get('access_token')
+            else:
                 raise aiohttp.ClientResponseError(r.request_info, r.history)
 
+        # Get user data
+        header = {'Authorization': f'Bearer {token}'}
+        async with session.get(f'{cls.base_url}/api/v2/me/{gamemode.url_name}', headers=header) as r:
+            if r.status == 200:
+                data = await r.json()
+                return data
+            raise aiohttp.ClientResponseError(r.request_info, r.history)
+
     @classmethod
     async def generate_auth_link(cls, discord_user_id: int, gamemode: Gamemode) -> str:
         """
@@ -145,11 +383,11 @@ class OsuApi:
         verficiation = database.Verification(
             discord_id=discord_user_id,
             uuid=identifier,
-            expires=datetime.now(timezone.utc) + timedelta(minutes=2)
+            expires=datetime.now(timezone.utc) + cls.verification_lifetime
         )
         await database.VerificationTable().insert(verficiation)
 
-        return f'https://osu.ppy.sh/oauth/authorize?client_id={cls.base_payload.get("client_id")}' + \
+        return f'{cls.base_url}/oauth/authorize?client_id={cls.base_payload.get("client_id")}' + \
                f'&redirect_uri={cls.user_payload.get("redirect_uri")}' + \
                f'&state={state}&response_type=code&scope=identify'
 
@@ -157,9 +395,10 @@ class OsuApi:
     async def update_user_rank(
         guild: database.Guild,
         member: discord.Member,
-        osu_user: dict,
+        osu_user: OsuUserSnapshot,
         gamemode: Gamemode,
-        reason: str = None
+        reason: str = None,
+        dispatcher: RoleEditDispatcher | None = None
     ) -> dict:
         """
         Update a user's rank in a guild (if they're not blacklisted or from a non-whitelisted country)
@@ -168,24 +407,27 @@ class OsuApi:
         ----------
         guild (database.GuildTable): A fetched guild from the database
         member (discord.Member): A Discord member object
-        osu_user (dict): userinfo from the osu! API
+        osu_user (OsuUserSnapshot): The parsed user info from the osu! API
         gamemode (Gamemode): The gamemode the rank is for
         reason (str): The reason for the rank update
+        dispatcher (RoleEditDispatcher): Queues the role edit instead of applying it right away, if given
 
         Returns
         ----------
-        dict: Information about the rank update. {success: bool, message: str}
+        dict: Information about the rank update. {success: bool, changed: bool, message: str}.
+              Queued edits also include edit: asyncio.Future, which resolves once the edit has been applied
         """
 
         # Check if the user is blacklisted
-        if guild.blacklisted_osu_users and osu_user['id'] in guild.blacklisted_osu_users:
-            return {'success': False, 'message': 'You are blacklisted from this guild'}
+        if guild.blacklisted_osu_users and osu_user.id in guild.blacklisted_osu_users:
+            return {'success': False, 'changed': False, 'message': 'You are blacklisted from this guild'}
 
         # Check if the user is from a whitelisted country
-        if guild.whitelisted_countries and osu_user['country']['code'] not in guild.whitelisted_countries:
-            return {'success': False, 'message': 'You are not from a country that\'s whitelisted in this guild'}
+        if guild.whitelisted_countries and osu_user.country_code not in guild.whitelisted_countries:
+            return {'success': False, 'changed': False,
+                    'message': 'You are not from a country that\'s whitelisted in this guild'}
 
-        rank = osu_user['statistics']['global_rank']
+        rank = osu_user.global_rank
 
         # Rank roles
         # This is terrible, I know :P
@@ -229,9 +471,19 @@ class OsuApi:
         roles_to_add = [member.guild.get_role(getattr(guild, r)) for r in roles_to_add if getattr(guild, r)]
         roles_to_remove = [member.guild.get_role(getattr(guild, r)) for r in roles_to_remove if getattr(guild, r)]
 
-        await member.remove_roles(*roles_to_remove, reason=reason)
-        await member.add_roles(*roles_to_add, reason=reason)
-        return {'success': True, 'message': 'Your roles have been updated in accordance to your current osu! rank!'}
+        # Only talk to Discord if something actually changes, and do it in a single request
+        if (roles := discord_utils.diff_roles(member, roles_to_add, roles_to_remove)) is None:
+            return {'success': True, 'changed': False,
+                    'message': 'Your roles are already up to date with your current osu! rank!'}
+
+        update = {'success': True, 'changed': True,
+                  'message': 'Your roles have been updated in accordance to your current osu! rank!'}
+        if dispatcher:
+            update['edit'] = dispatcher.submit(member, roles_to_add, roles_to_remove, reason=reason)
+        else:
+            await member.edit(roles=roles, reason=reason)
+            metrics.ROLE_EDITS.labels('success').inc()
+        return update
 
     @staticmethod
     def __get_roles_to_remove(roles_to_add: list[str]) -> list[str]:  # TODO: make an enum or something. idk
@@ -259,6 +511,94 @@ class OsuApi:
         return roles_to_remove
 
 
+metrics.register_cache('osu_user_cache', OsuApi.user_cache)
+
+
+@dataclass(frozen=True)
+class OsuUserSnapshot:
+    """The parts of an osu! user that are needed to update their roles"""
+
+    id: int
+    country_code: str
+    global_rank: int | None
+    pp: float | None
+
+    @classmethod
+    def from_api(cls, osu_user: dict) -> OsuUserSnapshot:
+        """
+        Creates an instance of its class from a user returned by the osu! API
+
+        Parameters
+        -----------
+        osu_user (dict): userinfo from the osu! API
+
+        Returns
+        -----------
+        OsuUserSnapshot: An OsuUserSnapshot object
+        """
+
+        statistics = osu_user.get('statistics') or {}
+        return cls(
+            id=osu_user['id'],
+            country_code=osu_user['country']['code'],
+            global_rank=statistics.get('global_rank'),
+            pp=statistics.get('pp')
+        )
+
+    @classmethod
+    def from_rank_state(cls, state: database.RankState) -> OsuUserSnapshot:
+        """
+        Creates an instance of its class from a stored rank state
+
+        Parameters
+        -----------
+        state (database.RankState): A rank state from the database
+
+        Returns
+        -----------
+        OsuUserSnapshot: An OsuUserSnapshot object
+        """
+
+        return cls(id=state.osu_id, country_code=state.country_code, global_rank=state.last_rank, pp=state.last_pp)
+
+    def to_rank_state(
+        self,
+        discord_id: int,
+        gamemode: Gamemode,
+        previous: database.RankState | None,
+        scheduler: UpdateScheduler
+    ) -> database.RankState:
+        """
+        Converts the snapshot to a rank state that can be stored in the database
+
+        Parameters
+        -----------
+        discord_id (int): The Discord ID of the user the snapshot belongs to
+        gamemode (Gamemode): The gamemode the snapshot is for
+        previous (database.RankState): The user's previous rank state, if any
+        scheduler (UpdateScheduler): Decides when the user should be checked again
+
+        Returns
+        -----------
+        database.RankState: A rank state object fetched right now
+        """
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        velocity = scheduler.velocity(previous, self.global_rank, now)
+
+        return database.RankState(
+            discord_id=discord_id,
+            gamemode=gamemode.id,
+            osu_id=self.id,
+            country_code=self.country_code,
+            last_rank=self.global_rank,
+            last_pp=self.pp,
+            last_fetched_at=now,
+            rank_velocity=velocity,
+            next_check_at=scheduler.next_check(self.global_rank, velocity, now)
+        )
+
+
 @dataclass
 class Gamemode:
     id: int
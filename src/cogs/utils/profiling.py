@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+
+import yappi
+
+
+class Profile:
+    """
+    A wall clock profiling run backed by yappi. Awaits are attributed to the coroutine that's waiting,
+    so time spent on the osu! API or Discord shows up where it's spent. yappi profiles the whole process,
+    so only one profile can run at a time
+    """
+
+    running: Profile | None = None
+    directory = Path('profiles')
+
+    def __init__(self, name: str):
+        """
+        Parameters
+        ----------
+        name (str): What's being profiled. Used in the file name of the results
+        """
+
+        self.name = name
+        self.path: Path | None = None
+        self.stats: yappi.YFuncStats | None = None
+        self.finished = asyncio.get_running_loop().create_future()
+
+    def start(self) -> None:
+        """
+        Starts profiling
+
+        Raises
+        ----------
+        RuntimeError: If another profile is already running
+        """
+
+        if Profile.running:
+            raise RuntimeError('A profile is already running')
+        Profile.running = self
+
+        yappi.set_clock_type('wall')
+        yappi.clear_stats()
+        yappi.start()
+
+    def stop(self) -> None:
+        """
+        Stops profiling and saves the results as a pstats file, which can be loaded by
+        pstats, snakeviz or flameprof among others
+        """
+
+        yappi.stop()
+        Profile.running = None
+
+        self.stats = yappi.get_func_stats()
+        yappi.clear_stats()
+
+        self.directory.mkdir(exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        self.path = self.directory / f'{self.name}-{timestamp}.pstat'
+        self.stats.save(str(self.path), type='pstat')
+
+        if not self.finished.done():
+            self.finished.set_result(self.path)
+
+    def summary(self, top: int = 15) -> str:
+        """
+        Lists the functions that took the most time, including time spent in the functions they called
+
+        Parameters
+        ----------
+        top (int): How many functions to list
+
+        Returns
+        ----------
+        str: A table of total time, own time, call count and function
+        """
+
+        self.stats.sort('ttot', 'desc')
+
+        lines = [f'{"total":>9} {"own":>9} {"calls":>7}  function']
+        for stat in self.stats[:top]:
+            lines.append(f'{stat.ttot:9.3f} {stat.tsub:9.3f} {stat.ncall:>7}  {stat.name} ' +
+                         f'({Path(stat.module).name}:{stat.lineno})')
+        return '\n'.join(lines)
@@ -0,0 +1,49 @@
+import asyncio
+from time import monotonic
+
+
+class TokenBucket:
+    """Asynchronous token bucket used to pace outgoing requests"""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        """
+        Parameters
+        ----------
+        rate (float): Tokens added to the bucket per second
+        capacity (int): Max amount of tokens the bucket can hold. Defaults to one second worth of tokens
+        """
+
+        if rate <= 0:
+            raise ValueError('Rate must be positive')
+
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = monotonic()
+        self.lock = asyncio.Lock()
+
+    def __refill(self) -> None:
+        """
+        Adds the tokens that have been generated since the last refill
+        """
+
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """
+        Waits until the requested amount of tokens is available and consumes them
+
+        Parameters
+        ----------
+        tokens (int): The amount of tokens to consume
+        """
+
+        # The lock makes waiters queue up in order instead of racing for the same refill
+        async with self.lock:
+            self.__refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self.__refill()
+            self.tokens -= tokens
@@ -0,0 +1,114 @@
+import asyncio
+
+import discord
+
+from . import discord_utils, metrics
+from .rate_limiter import TokenBucket
+
+
+class RoleEditDispatcher:
+    """
+    Applies member role edits through one queue per guild. The queues are drained concurrently,
+    each paced by its own rate limiter, so a guild that's being rate limited by Discord only holds up its own edits
+    """
+
+    def __init__(self, rate: float = 2, capacity: int = 10):
+        """
+        Parameters
+        ----------
+        rate (float): Role edits per second per guild
+        capacity (int): Role edits a guild can burst before being paced
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.queues: dict[int, asyncio.Queue] = {}
+        self.drainers: dict[int, asyncio.Task] = {}
+        self.edits = 0
+        self.failures = 0
+
+    def submit(
+        self,
+        member: discord.Member,
+        roles_to_add: list[discord.Role | None],
+        roles_to_remove: list[discord.Role | None],
+        reason: str = None
+    ) -> asyncio.Future:
+        """
+        Queues up a role edit in the member's guild. The member's new roles are worked out when the edit is applied,
+        so changes made to their other roles while the edit waits in the queue are kept
+
+        Parameters
+        ----------
+        member (discord.Member): The member to edit
+        roles_to_add (list[discord.Role|None]): Roles the member should have. None values are ignored
+        roles_to_remove (list[discord.Role|None]): Roles the member should not have. None values are ignored
+        reason (str): The reason for the edit
+
+        Returns
+        ----------
+        asyncio.Future: Resolves once the edit has been applied, or right away if the member's roles are already
+                        right by then. Raises what the edit raised if it failed,
+                        and is cancelled if the dispatcher is closed before the edit is applied.
+                        Failures are left to the caller to log and retry
+        """
+
+        guild_id = member.guild.id
+        if guild_id not in self.queues:
+            self.queues[guild_id] = asyncio.Queue()
+            self.drainers[guild_id] = asyncio.create_task(self.__drain(self.queues[guild_id]))
+
+        edited = asyncio.get_running_loop().create_future()
+        self.queues[guild_id].put_nowait((member, roles_to_add, roles_to_remove, reason, edited))
+        return edited
+
+    async def close(self) -> None:
+        """
+        Stops draining the queues. Role edits that haven't been applied yet are dropped and their futures cancelled
+        """
+
+        for drainer in self.drainers.values():
+            drainer.cancel()
+        await asyncio.gather(*self.drainers.values(), return_exceptions=True)
+
+        for queue in self.queues.values():
+            while not queue.empty():
+                *_, edited = queue.get_nowait()
+                edited.cancel()
+
+        self.queues.clear()
+        self.drainers.clear()
+
+    async def __drain(self, queue: asyncio.Queue) -> None:
+        """
+        Applies a guild's role edits one by one until cancelled
+
+        Parameters
+        ----------
+        queue (asyncio.Queue): Queue of (discord.Member, list[discord.Role], list[discord.Role], str, asyncio.Future)
+                               tuples
+        """
+
+        limiter = TokenBucket(self.rate, self.capacity)
+
+        while True:
+            member, roles_to_add, roles_to_remove, reason, edited = await queue.get()
+            try:
+                await limiter.acquire()
+
+                # Diff against the member's roles as they are now, not as they were when the edit was queued
+                member = member.guild.get_member(member.id) or member
+                if (roles := discord_utils.diff_roles(member, roles_to_add, roles_to_remove)) is not None:
+                    await member.edit(roles=roles, reason=reason)
+                    self.edits += 1
+                    metrics.ROLE_EDITS.labels('success').inc()
+                edited.set_result(None)
+            except Exception as e:
+                self.failures += 1
+                metrics.ROLE_EDITS.labels('failed').inc()
+                edited.set_exception(e)
+            finally:
+                # Cancelled by close() in the middle of the edit
+                if not edited.done():
+                    edited.cancel()
+                queue.task_done()
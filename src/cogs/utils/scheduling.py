@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from . import database
+
+# Ranks where a player's digit role changes
+RANK_THRESHOLDS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+def distance_to_threshold(rank: int) -> int:
+    """
+    Counts how many ranks a player has to move before their digit role changes
+
+    Parameters
+    ----------
+    rank (int): The player's global rank
+
+    Returns
+    ----------
+    int: The distance to the closest threshold in either direction
+    """
+
+    return min(threshold - rank if rank < threshold else rank - threshold + 1 for threshold in RANK_THRESHOLDS)
+
+
+class UpdateScheduler:
+    """Works out when a user's rank should be checked next, based on how likely their role is to change"""
+
+    def __init__(
+        self,
+        min_interval: timedelta,
+        max_interval: timedelta,
+        safety_factor: float = 0.5,
+        baseline_drift: float = 0.01
+    ):
+        """
+        Parameters
+        ----------
+        min_interval (timedelta): Shortest time between two checks of the same user
+        max_interval (timedelta): Longest time between two checks of the same user
+        safety_factor (float): Fraction of the expected time to reach a threshold to wait before checking again
+        baseline_drift (float): Fraction of their rank an inactive player is assumed to drift per day
+        """
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.safety_factor = safety_factor
+        self.baseline_drift = baseline_drift
+
+    @classmethod
+    def from_config(cls, settings: dict) -> UpdateScheduler:
+        """
+        Creates an instance of its class from the rank_update config section
+
+        Parameters
+        ----------
+        settings (dict): The rank_update config section
+
+        Returns
+        ----------
+        UpdateScheduler: An UpdateScheduler object
+        """
+
+        return cls(
+            min_interval=timedelta(minutes=settings.get('min_check_minutes', 60)),
+            max_interval=timedelta(hours=settings.get('max_check_hours', 72))
+        )
+
+    @staticmethod
+    def velocity(previous: database.RankState | None, rank: int | None, now: datetime) -> float | None:
+        """
+        Estimates how fast a player's rank is moving, smoothed with the previous estimate
+
+        Parameters
+        ----------
+        previous (database.RankState): The player's previous rank state, if any
+        rank (int): The player's current rank
+        now (datetime): When the current rank was fetched
+
+        Returns
+        ----------
+        float: Ranks moved per hour. None if there's not enough data
+        """
+
+        if not previous or not previous.last_rank or not rank:
+            return None
+
+        hours = (now - previous.last_fetched_at).total_seconds() / 3600
+        if hours <= 0:
+            return previous.rank_velocity
+
+        velocity = (rank - previous.last_rank) / hours
+        if previous.rank_velocity is None:
+            return velocity
+        return (velocity + previous.rank_velocity) / 2
+
+    def next_check(self, rank: int | None, velocity: float | None, now: datetime) -> datetime:
+        """
+        Works out when a player should be checked next
+
+        Parameters
+        ----------
+        rank (int): The player's current rank
+        velocity (float): Ranks moved per hour, if known
+        now (datetime): When the current rank was fetched
+
+        Returns
+        ----------
+        datetime: When the player's rank should be checked again
+        """
+
+        # Unranked players only get a role again once they play, which we can't predict
+        if not rank:
+            return now + self.max_interval
+
+        # Even inactive players move as others pass them, so never assume a player is standing still
+        speed = max(abs(velocity or 0), rank * self.baseline_drift / 24)
+        hours = self.safety_factor * distance_to_threshold(rank) / speed
+
+        delay = min(max(timedelta(hours=hours), self.min_interval), self.max_interval)
+        return now + delay
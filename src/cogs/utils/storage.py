@@ -0,0 +1,526 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any
+
+import psycopg
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+
+class StorageEngine(ABC):
+    """
+    Storage behind the table layer. Tables write their queries for Postgres, with %s placeholders,
+    and engines for other databases translate them
+    """
+
+    # Raised by the engine when an INSERT conflicts with an existing row
+    unique_violation: type[Exception]
+
+    # Statements that create every table, in order
+    schema: tuple[str, ...]
+
+    @abstractmethod
+    async def open(self) -> None:
+        """
+        Connects to the database
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """
+        Disconnects from the database
+        """
+
+    @abstractmethod
+    def connection(self):
+        """
+        Borrows a connection. Used as an async context manager. The transaction is committed when the block exits,
+        or rolled back if it raises
+
+        Returns
+        ----------
+        AsyncContextManager: Yields a connection with psycopg's execute, cursor, commit and rollback methods
+        """
+
+    @abstractmethod
+    async def notify(self, channel: str, payload: str) -> None:
+        """
+        Sends a notification to everyone listening on a channel
+
+        Parameters
+        ----------
+        channel (str): The channel name
+        payload (str): The notification payload
+        """
+
+    @abstractmethod
+    def listen(self, channel: str) -> AsyncIterator[str]:
+        """
+        Waits for notifications on a channel
+
+        Parameters
+        ----------
+        channel (str): The channel name
+
+        Returns
+        ----------
+        AsyncIterator[str]: The payloads of the notifications as they arrive
+        """
+
+    @abstractmethod
+    async def version(self) -> str:
+        """
+        Fetches the database name and version
+
+        Returns
+        ----------
+        str: The database name and its version number
+        """
+
+
+def create_engine(config: dict) -> StorageEngine:
+    """
+    Creates the storage engine chosen in the database config section
+
+    Parameters
+    ----------
+    config (dict): The database config section
+
+    Returns
+    ----------
+    StorageEngine: The engine. Not opened yet
+
+    Raises
+    ----------
+    ValueError: If the engine is unknown
+    """
+
+    match config.get('engine', 'postgres'):
+        case 'postgres':
+            return PostgresEngine(config)
+        case 'sqlite':
+            return SqliteEngine(config.get('path', 'osu-rank-tracker.db'))
+        case engine:
+            raise ValueError(f'Unknown database engine: {engine}')
+
+
+class PostgresEngine(StorageEngine):
+    """Postgres through a psycopg connection pool. Every bot and verification server process can share it"""
+
+    unique_violation = psycopg.errors.UniqueViolation
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS public.guild (
+            discord_id bigint NOT NULL PRIMARY KEY,
+            whitelisted_countries char(2)[],
+            blacklisted_osu_users integer[],
+            role_remove bigint,
+            role_add bigint,
+            role_1_digit bigint,
+            role_2_digit bigint,
+            role_3_digit bigint,
+            role_4_digit bigint,
+            role_5_digit bigint,
+            role_6_digit bigint,
+            role_7_digit bigint,
+            role_standard bigint,
+            role_taiko bigint,
+            role_ctb bigint,
+            role_mania bigint
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.user (
+            discord_id bigint NOT NULL PRIMARY KEY,
+            osu_id integer NOT NULL,
+            gamemode smallint NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.user_rank_state (
+            discord_id bigint NOT NULL REFERENCES public.user ON DELETE CASCADE,
+            gamemode smallint NOT NULL,
+            osu_id integer NOT NULL,
+            country_code char(2) NOT NULL,
+            last_rank integer,
+            last_pp real,
+            last_fetched_at TIMESTAMP NOT NULL,
+            rank_velocity real,
+            next_check_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (discord_id, gamemode)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS user_rank_state_next_check_at_idx
+        ON public.user_rank_state (next_check_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.update_job (
+            guild_id bigint NOT NULL REFERENCES public.guild ON DELETE CASCADE,
+            discord_id bigint NOT NULL REFERENCES public.user ON DELETE CASCADE,
+            leased_by TEXT,
+            lease_expires TIMESTAMPTZ,
+            attempts smallint NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, discord_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.verification (
+            discord_id bigint NOT NULL PRIMARY KEY,
+            uuid TEXT NOT NULL,
+            expires TIMESTAMPTZ
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS verification_expires_idx
+        ON public.verification (expires)
+        """,
+        # Databases created before expires had a time zone. The old values were converted to the session's
+        # time zone when they were written, which is also how they're read back here. Only altered once, since
+        # ALTER TABLE locks the table even when there's nothing to change
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = 'verification' AND column_name = 'expires'
+                AND data_type = 'timestamp without time zone'
+            ) THEN
+                ALTER TABLE public.verification ALTER COLUMN expires TYPE TIMESTAMPTZ;
+            END IF;
+        END
+        $$
+        """
+    )
+
+    def __init__(self, config: dict):
+        """
+        Parameters
+        ----------
+        config (dict): The database config section
+        """
+
+        self.config = config
+        self.pool: AsyncConnectionPool | None = None
+
+    def __connection_kwargs(self) -> dict:
+        """
+        Returns the connection parameters from the config
+
+        Returns
+        ----------
+        dict: Keyword arguments for psycopg connections
+        """
+
+        return {
+            'host': self.config['host'],
+            'dbname': self.config['dbname'],
+            'user': self.config['username'],
+            'password': self.config['password']
+        }
+
+    async def open(self) -> None:
+        pool_config = self.config.get('pool', {})
+        self.pool = AsyncConnectionPool(
+            kwargs=self.__connection_kwargs(),
+            min_size=pool_config.get('min_size', 2),
+            max_size=pool_config.get('max_size', 10),
+            timeout=pool_config.get('timeout', 10),  # Seconds to wait for a free connection
+            open=False
+        )
+        await self.pool.open(wait=True)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    def connection(self):
+        return self.pool.connection()
+
+    async def notify(self, channel: str, payload: str) -> None:
+        async with self.pool.connection() as connection:
+            await connection.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+
+    async def listen(self, channel: str) -> AsyncIterator[str]:
+        # Uses its own connection so it doesn't hold one from the pool
+        connection_kwargs = self.__connection_kwargs()
+        async with await psycopg.AsyncConnection.connect(**connection_kwargs, autocommit=True) as connection:
+            await connection.execute(sql.SQL('LISTEN {}').format(sql.Identifier(channel)))
+            async for notification in connection.notifies():
+                yield notification.payload
+
+    async def version(self) -> str:
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute('SELECT VERSION()')
+            version = (await cursor.fetchone())[0].split(' ')[:2]
+        return ' '.join(version)
+
+
+# Timestamps are stored as seconds since the epoch, so they compare and add up like they do in Postgres
+SQLITE_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+sqlite3.register_converter('JSON', json.loads)
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromtimestamp(float(value), timezone.utc)
+                           .replace(tzinfo=None))
+sqlite3.register_converter('TIMESTAMPTZ', lambda value: datetime.fromtimestamp(float(value), timezone.utc))
+
+
+@lru_cache(maxsize=256)
+def sqlite_query(query: str) -> str:
+    """
+    Translates a Postgres query used by the table layer to SQLite
+
+    Parameters
+    ----------
+    query (str): The Postgres query
+
+    Returns
+    ----------
+    str: The SQLite query
+    """
+
+    query = query.replace('public.', '')
+    query = re.sub(r'FOR\s+UPDATE\s+SKIP\s+LOCKED', '', query)  # SQLite only has one writer at a time anyway
+    query = re.sub(r'=\s*ANY\(%s\)', 'IN (SELECT value FROM json_each(%s))', query)  # Lists are passed as JSON
+    query = re.sub(r'\bnow\(\)', SQLITE_NOW, query)
+    return query.replace('%s', '?')
+
+
+def sqlite_value(value: Any) -> Any:
+    """
+    Converts a query parameter to how it's stored in SQLite
+
+    Parameters
+    ----------
+    value (Any): The parameter
+
+    Returns
+    ----------
+    Any: The stored value. Lists become compact JSON, timestamps seconds since the epoch and intervals seconds
+    """
+
+    if isinstance(value, (list, tuple)):
+        return json.dumps(value, separators=(',', ':'))
+    if isinstance(value, datetime):
+        if not value.tzinfo:
+            value = value.replace(tzinfo=timezone.utc)  # Naive timestamps are UTC throughout the bot
+        return value.timestamp()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+class SqliteCursor:
+    """Results of a query on SQLite, fetched ahead of time so they can be read without going back to the thread"""
+
+    def __init__(self, connection: SqliteConnection, rows: list[tuple] | None = None):
+        self.connection = connection
+        self.rows = rows or []
+
+    async def __aenter__(self) -> SqliteCursor:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def fetchone(self) -> tuple | None:
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self) -> list[tuple]:
+        return self.rows
+
+    async def execute(self, query: str, params: Iterable = ()) -> SqliteCursor:
+        self.rows = (await self.connection.execute(query, params)).rows
+        return self
+
+    async def executemany(self, query: str, params_seq: Iterable[Iterable]) -> None:
+        await self.connection.executemany(query, params_seq)
+
+
+class SqliteConnection:
+    """Wraps the engine's SQLite connection with the parts of psycopg's async connection the tables use"""
+
+    def __init__(self, engine: SqliteEngine):
+        self.engine = engine
+
+    async def execute(self, query: str, params: Iterable = (), prepare: bool | None = None) -> SqliteCursor:
+        # prepare is only there to match psycopg. sqlite3 already keeps the statements it has run compiled
+        query = sqlite_query(query)
+        params = [sqlite_value(param) for param in params]
+        return SqliteCursor(self, await self.engine.run(lambda db: db.execute(query, params).fetchall()))
+
+    async def executemany(self, query: str, params_seq: Iterable[Iterable]) -> None:
+        query = sqlite_query(query)
+        params_seq = [[sqlite_value(param) for param in params] for params in params_seq]
+        await self.engine.run(lambda db: db.executemany(query, params_seq))
+
+    def cursor(self) -> SqliteCursor:
+        return SqliteCursor(self)
+
+    async def commit(self) -> None:
+        await self.engine.run(lambda db: db.commit())
+
+    async def rollback(self) -> None:
+        await self.engine.run(lambda db: db.rollback())
+
+
+class SqliteEngine(StorageEngine):
+    """
+    Embedded SQLite in WAL mode. Needs no database server, but only works for a single process:
+    notifications are delivered within the process, so the verification server has to be embedded in the bot
+    """
+
+    unique_violation = sqlite3.IntegrityError
+
+    schema = (
+        """
+        CREATE TABLE IF NOT EXISTS guild (
+            discord_id INTEGER NOT NULL PRIMARY KEY,
+            whitelisted_countries JSON,
+            blacklisted_osu_users JSON,
+            role_remove INTEGER,
+            role_add INTEGER,
+            role_1_digit INTEGER,
+            role_2_digit INTEGER,
+            role_3_digit INTEGER,
+            role_4_digit INTEGER,
+            role_5_digit INTEGER,
+            role_6_digit INTEGER,
+            role_7_digit INTEGER,
+            role_standard INTEGER,
+            role_taiko INTEGER,
+            role_ctb INTEGER,
+            role_mania INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user (
+            discord_id INTEGER NOT NULL PRIMARY KEY,
+            osu_id INTEGER NOT NULL,
+            gamemode INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_rank_state (
+            discord_id INTEGER NOT NULL REFERENCES user ON DELETE CASCADE,
+            gamemode INTEGER NOT NULL,
+            osu_id INTEGER NOT NULL,
+            country_code TEXT NOT NULL,
+            last_rank INTEGER,
+            last_pp REAL,
+            last_fetched_at TIMESTAMP NOT NULL,
+            rank_velocity REAL,
+            next_check_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (discord_id, gamemode)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS user_rank_state_next_check_at_idx
+        ON user_rank_state (next_check_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS update_job (
+            guild_id INTEGER NOT NULL REFERENCES guild ON DELETE CASCADE,
+            discord_id INTEGER NOT NULL REFERENCES user ON DELETE CASCADE,
+            leased_by TEXT,
+            lease_expires TIMESTAMPTZ,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, discord_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS verification (
+            discord_id INTEGER NOT NULL PRIMARY KEY,
+            uuid TEXT NOT NULL,
+            expires TIMESTAMPTZ
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS verification_expires_idx
+        ON verification (expires)
+        """
+    )
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path (str): The database file. Created if it doesn't exist
+        """
+
+        self.path = path
+        self.db: sqlite3.Connection | None = None
+        self.lock = asyncio.Lock()
+        self.channels: dict[str, set[asyncio.Queue]] = {}
+
+        # sqlite3 blocks, so every call goes through a single thread of its own. That also keeps the connection
+        # on the thread it was made on
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+
+    async def run(self, function):
+        """
+        Runs a function with the SQLite connection on the engine's thread
+
+        Parameters
+        ----------
+        function (Callable[[sqlite3.Connection], Any]): The function to run
+
+        Returns
+        ----------
+        Any: What the function returned
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, self.db)
+
+    async def open(self) -> None:
+        def connect(_):
+            db = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')  # Safe with WAL. Only the last commits can be lost on power loss
+            db.execute('PRAGMA foreign_keys = ON')
+            return db
+
+        self.db = await self.run(connect)
+
+    async def close(self) -> None:
+        await self.run(lambda db: db.close())
+        self.executor.shutdown()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[SqliteConnection]:
+        # There's only one connection, so blocks take turns to keep their transactions apart
+        async with self.lock:
+            connection = SqliteConnection(self)
+            try:
+                yield connection
+            except BaseException:
+                await connection.rollback()
+                raise
+            else:
+                await connection.commit()
+
+    async def notify(self, channel: str, payload: str) -> None:
+        for queue in self.channels.get(channel, ()):
+            queue.put_nowait(payload)
+
+    async def listen(self, channel: str) -> AsyncIterator[str]:
+        queue = asyncio.Queue()
+        self.channels.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.channels[channel].discard(queue)
+
+    async def version(self) -> str:
+        return f'SQLite {sqlite3.sqlite_version}'
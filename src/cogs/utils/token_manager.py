@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from time import monotonic
+
+
+class TokenManager:
+    """
+    Keeps an OAuth access token valid. The token is refreshed in the background ahead of its expiry,
+    and concurrent callers share a single in-flight refresh instead of each requesting their own token
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[tuple[str, int]]], refresh_margin: float = 0.1):
+        """
+        Parameters
+        ----------
+        fetch (Callable[[], Awaitable[tuple[str, int]]]): Coroutine function that requests a new token.
+            Returns the token and its lifetime in seconds
+        refresh_margin (float): Fraction of the token's lifetime left when it's refreshed in the background
+        """
+
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.token: str | None = None
+        self.expires_at = 0.0
+        self.refresh_at = 0.0
+        self.refresh_task: asyncio.Task | None = None
+
+    async def get(self) -> str:
+        """
+        Returns a valid token. Only waits for a refresh if there's no valid token to hand out
+
+        Returns
+        ----------
+        str: The access token
+        """
+
+        now = monotonic()
+        if self.token and now < self.expires_at:
+            if now >= self.refresh_at:
+                # Still valid, so hand it out while a new one is fetched
+                self.__start_refresh()
+            return self.token
+
+        return await asyncio.shield(self.__start_refresh())
+
+    async def invalidate(self, token: str) -> str:
+        """
+        Discards a token the API rejected and returns a new one.
+        Callers rejected with the same token all wait on the same re-authentication
+
+        Parameters
+        ----------
+        token (str): The rejected token
+
+        Returns
+        ----------
+        str: A new access token
+        """
+
+        if self.token == token:
+            self.token = None
+            self.expires_at = 0.0
+        elif self.token and monotonic() < self.expires_at:
+            # Someone else has already replaced the rejected token
+            return self.token
+
+        return await asyncio.shield(self.__start_refresh())
+
+    def __start_refresh(self) -> asyncio.Task:
+        """
+        Starts a refresh unless one is already in flight
+
+        Returns
+        ----------
+        asyncio.Task: The in-flight refresh
+        """
+
+        if not self.refresh_task:
+            self.refresh_task = asyncio.create_task(self.__refresh())
+            self.refresh_task.add_done_callback(self.__log_failure)
+        return self.refresh_task
+
+    async def __refresh(self) -> str:
+        """
+        Fetches a new token and works out when it should be refreshed
+
+        Returns
+        ----------
+        str: The new access token
+        """
+
+        try:
+            token, expires_in = await self.fetch()
+            now = monotonic()
+            self.token = token
+            self.expires_at = now + expires_in
+            self.refresh_at = now + expires_in * (1 - self.refresh_margin)
+            return token
+        finally:
+            self.refresh_task = None
+
+    @staticmethod
+    def __log_failure(task: asyncio.Task) -> None:
+        """
+        Logs failed refreshes. Background refreshes have nobody waiting on them to see the error
+
+        Parameters
+        ----------
+        task (asyncio.Task): The finished refresh
+        """
+
+        if not task.cancelled() and task.exception():
+            logging.getLogger('discord').error('Failed to refresh access token', exc_info=task.exception())
@@ -1,21 +1,23 @@
+import asyncio
 from codecs import open
 from os import listdir
-from threading import Thread
 from time import time
 
 import discord
 import uvicorn
 import yaml
 from discord.ext import commands
+from prometheus_client import start_http_server
 
 import cogs.utils.database as database
+from cogs.utils import metrics
+from cogs.utils.expiry import ExpiryScheduler
+from cogs.utils.osu_api import OsuApi
 from logger import BotLogger
 
 with open('./src/config/config.yaml', 'r', encoding='utf8') as f:
     config = yaml.load(f, Loader=yaml.SafeLoader)
 
-database.Database().init_db()
-
 
 class Bot(commands.Bot):
     def __init__(self):
@@ -31,17 +33,41 @@ class Bot(commands.Bot):
         self.presence = config['bot'].get('presence', {})
         self.emoji = config.get('emoji', {})
         self.misc = config.get('misc', {})
+        self.rank_update = config.get('rank_update', {})
 
-        # Start verification server
-        server_port = config['server'].get('port', 80)
-        server = Thread(
-            target=uvicorn.run,
-            args=('verification_server.server:app',),
-            kwargs={'port': server_port, 'host': '0.0.0.0'}
-        )
-        server.start()
+        self.server = None  # Verification server, started in setup_hook
+        self.verification_expiry = None  # Deletes pending verifications once they expire, started in setup_hook
+        self.loop_lag_task = None  # Measures event loop lag for the metrics endpoint, started in setup_hook
 
     async def setup_hook(self):
+        # Shared database engine, a connection pool or an embedded SQLite database
+        await database.Database.open_engine()
+        await database.Database().init_db()
+
+        # Shared HTTP session for the osu! API
+        await OsuApi.open_session()
+
+        # Expire pending verifications. Owned by the bot instead of a cog so scheduled expiries survive cog reloads
+        verification_table = database.VerificationTable()
+        self.verification_expiry = ExpiryScheduler(verification_table.delete)
+        for verification in await verification_table.get_all():
+            self.verification_expiry.schedule(verification.discord_id, verification.expires)
+        self.verification_expiry.start()
+
+        # Start verification server. Runs on the bot's event loop so it can share the HTTP session and database pool.
+        # Can be turned off when the server is run as its own process instead
+        if config['server'].get('embedded', True):
+            server_port = config['server'].get('port', 80)
+            self.server = uvicorn.Server(
+                uvicorn.Config('verification_server.server:app', port=server_port, host='0.0.0.0')
+            )
+            self.server_task = asyncio.create_task(self.server.serve())
+        else:
+            # The verification server normally serves /metrics. Without it, the bot needs its own endpoint
+            start_http_server(config.get('metrics', {}).get('port', 9100))
+
+        self.loop_lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+
         # Load cogs
         for file in listdir('./src/cogs'):
             if file.endswith('.py'):
@@ -55,6 +81,20 @@ class Bot(commands.Bot):
             self.tree.copy_global_to(guild=discord.Object(id=config['dev_guild_id']))
             await self.tree.sync(guild=discord.Object(id=config['dev_guild_id']))
 
+    async def close(self):
+        # Stop verification server and release shared resources before disconnecting
+        if self.loop_lag_task:
+            self.loop_lag_task.cancel()
+        if self.server:
+            self.server.should_exit = True
+            await self.server_task
+        if self.verification_expiry:
+            await self.verification_expiry.stop()
+        await OsuApi.close_session()
+        await database.Database.close_engine()
+
+        await super().close()
+
 
 bot = Bot()
 
@@ -1,21 +1,50 @@
+import json
 import sys
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from pathlib import Path
 
-sys.path.append('..')  # Allow to share the same database abstractions and connection
+# Allow to share the same database abstractions and connection
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from fastapi import FastAPI, Request  # noqa E402
 from fastapi.responses import RedirectResponse  # noqa E402
 from fastapi.staticfiles import StaticFiles  # noqa E402
 from fastapi.templating import Jinja2Templates  # noqa E402
+from prometheus_client import make_asgi_app  # noqa E402
 
 from cogs.utils import database  # noqa E402
 from cogs.utils.osu_api import Gamemode, OsuApi  # noqa E402
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the database and osu! HTTP session when the server runs as its own process.
+    When embedded in the bot they're already open and owned by the bot
+    """
+
+    standalone = database.Database.engine is None
+    if standalone:
+        await database.Database.open_engine()
+        await OsuApi.open_session()
+
+    yield
+
+    if standalone:
+        await OsuApi.close_session()
+        await database.Database.close_engine()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # HTML templates to serve prettier feedback to the user
 app.mount('/static', StaticFiles(directory='src/verification_server/static'), name='static')
 templates = Jinja2Templates(directory='src/verification_server/templates')
 
+# Prometheus metrics. Includes the bot's own metrics when the server is embedded in the bot
+app.mount('/metrics', make_asgi_app())
+
 
 @app.get('/')
 async def index():
@@ -35,12 +64,12 @@ async def callback(request: Request, code: str, state: str):
 
     gamemode = Gamemode.from_id(int(gamemode))
 
-    # Check if user is pending verification
+    # Check if user is pending verification. Expired verifications are treated as missing
     verification_table = database.VerificationTable()
-    verification = await verification_table.get(discord_id)
+    verification = await verification_table.get_pending(discord_id)
 
     # Verify user link
-    if not verification and verification.uuid != uuid:
+    if not verification or verification.uuid != uuid:
         return templates.TemplateResponse(
             'error.html',
             {'request': request, 'message': 'Not a valid user or identifier'}
@@ -59,9 +88,12 @@ async def callback(request: Request, code: str, state: str):
     print(discord_id, osu_id, gamemode.id)
 
     # Enter user into database
-    user = database.User(discord_id=discord_id, osu_id=osu_id, gamemode=gamemode.id)
+    user = database.User(discord_id=int(discord_id), osu_id=osu_id, gamemode=gamemode.id)
     await database.UserTable().save(user)
 
+    # Let the bot know right away so it can give the user their roles
+    await database.Database.notify(database.USER_REGISTERED_CHANNEL, json.dumps(asdict(user)))
+
     await verification_table.delete(discord_id)
 
     return RedirectResponse(f'/success/{osu_name}', status_code=303)
@@ -70,3 +102,20 @@ async def callback(request: Request, code: str, state: str):
 @app.get('/success/{name}')
 async def success(request: Request, name: str):
     return templates.TemplateResponse('success.html', {'request': request, 'name': name})
+
+
+if __name__ == '__main__':
+    # Standalone mode. Runs the server in its own worker processes that only share the database with the bot
+    import uvicorn
+    import yaml
+
+    with open('./src/config/config.yaml', 'r', encoding='utf8') as f:
+        server_config = yaml.load(f, Loader=yaml.SafeLoader).get('server', {})
+
+    uvicorn.run(
+        'verification_server.server:app',
+        host='0.0.0.0',
+        port=server_config.get('port', 80),
+        workers=server_config.get('workers', 2),
+        app_dir=str(Path(__file__).resolve().parents[1])
+    )